@@ -1,6 +1,14 @@
-from machine import Pin, SPI
-import struct
+from machine import Pin, SPI, ADC, idle, lightsleep
 from nrf24l01 import NRF24L01
+from protocol import pack_telemetry, TELEMETRY_SIZE, NEVER
+from protocol import frame_type, alert_seq, alert_side, alert_distance, FRAME_ALERT, BROADCAST_PIPE
+from protocol import alert_mode, mode_threshold, MODE_THRESHOLD_MM
+from protocol import frame_arg, FRAME_HOP, FRAME_PING, FRAME_RADIO
+from protocol import RENDEZVOUS_CHANNEL, DEFAULT_RF_SETUP, LINK_TIMEOUT_MS
+from rfsurvey import retune, set_rf
+from haptic import Haptic, PATTERN_PULSE
+from buttons import Buttons, GESTURE_HOLD
+import micropython
 import time
 
 # Initialize onboard LED for reception indication
@@ -15,33 +23,82 @@ spi = SPI(1, polarity=0, phase=0, sck=Pin(7), mosi=Pin(9), miso=Pin(8), baudrate
 # Define communication pipes (RX address must match TX pipe of sender)
 pipes = b"\xe1\xf0\xf0\xf0\x01"
 EXPECTED_TRIGGER = 1
+RX_PIPE = 0
+BROADCAST_RX_PIPE = 1  # Alerts for both sides, sent without ACK
 
 def radio_setup():
     # Initialize and configure NRF24L01
     nrf = NRF24L01(spi, csn, ce, payload_size=4)
-    nrf.set_channel(108)
-    nrf.set_power_speed(0, 1)
+    nrf.set_channel(RENDEZVOUS_CHANNEL)  # The master moves us to a quieter channel with a HOP frame
+    set_rf(nrf, DEFAULT_RF_SETUP)  # Speed and power must match the master's; it may change both later
     print("Status:", nrf.reg_read(0x07))
-    nrf.open_rx_pipe(0, pipes)  # Listen to sender's address
+    # Dynamic payloads so the master can read telemetry back from our auto-ACK
+    nrf.enable_ack_payload()
+    # Only RX_DR may pull IRQ low. Sending an ACK payload sets TX_DS, and an
+    # unmasked TX_DS would hold the line low so the next RX_DR gave no edge.
+    nrf.mask_irq(tx_ds=True, max_rt=True)
+    nrf.open_rx_pipe(RX_PIPE, pipes)  # Listen to sender's address
+    nrf.open_rx_pipe(BROADCAST_RX_PIPE, BROADCAST_PIPE)
     nrf.start_listening()  # Begin listening for messages
+    load_telemetry(nrf)
     print("RF_SETUP:", bin(nrf.reg_read(0x06)))
     print("Channel:", nrf.reg_read(0x05))
     print("CONFIG:", bin(nrf.reg_read(0x00)))
     print("FIFO_STATUS:", bin(nrf.reg_read(0x17)))
     return nrf
+
+# ------------------------------
+# Telemetry (sent back in the ACK)
+# ------------------------------
+# Battery sense: set BATTERY_PIN to an ADC-capable GPIO (GPIO1-10 on the
+# XIAO ESP32-S3) wired to the battery through a 1:BATTERY_DIVIDER divider.
+# None reports the battery as unknown (0 mV).
+BATTERY_PIN = None
+BATTERY_DIVIDER = 2
+
+def battery_setup(pin):
+    if pin is None:
+        return None
+    try:
+        adc = ADC(Pin(pin))
+    except (ValueError, OSError):
+        print("GPIO{} has no ADC; battery not measured".format(pin))
+        return None
+    if hasattr(adc, "atten"):
+        adc.atten(ADC.ATTN_11DB)  # Full 0-3.3 V range on the ESP32
+    return adc
+
+battery_adc = battery_setup(BATTERY_PIN)
+telemetry_buf = bytearray(TELEMETRY_SIZE)
+last_alarm_ms = None
+rx_errors = 0
+
+def battery_mv():
+    if battery_adc is None:
+        return 0
+    return battery_adc.read_u16() * 3300 * BATTERY_DIVIDER // 65535
+
+def load_telemetry(nrf):
+    # Replace whatever ACK payload is queued with a fresh snapshot; it goes
+    # out with the master's next trigger
+    if last_alarm_ms is None:
+        since = NEVER
+    else:
+        since = time.ticks_diff(time.ticks_ms(), last_alarm_ms) // 1000
+    pack_telemetry(telemetry_buf, battery_mv(), since, rx_errors)
+    nrf.flush_tx()
+    nrf.write_ack_payload(RX_PIPE, telemetry_buf)
+
 # ------------------------------
 # Output Devices (Left Slave)
 # ------------------------------
 # Buzzer on GPIO5 and Vibrating Motor on GPIO6.
-buzzer   = Pin(5, Pin.OUT)
-vib_motor = Pin(6, Pin.OUT)
-
-def activate_alarm(duration_ms=500):
-    buzzer.value(1)
-    vib_motor.value(1)
-    time.sleep_ms(duration_ms)
-    buzzer.value(0)
-    vib_motor.value(0)
+# Both are PWM driven from a timer, so an alarm never blocks the radio.
+haptic = Haptic(Pin(5, Pin.OUT), Pin(6, Pin.OUT))
+def activate_alarm(distance_mm=0, range_mm=MODE_THRESHOLD_MM[0], duration_ms=500):
+    # Returns at once; a newer alert replaces the one playing. Distances at or
+    # beyond range_mm (the master's alert threshold) give the weakest, slowest pulses
+    haptic.play(PATTERN_PULSE, distance_mm, range_mm, duration_ms)
 
 # ------------------------------
 # Wake Button Setup (common)
@@ -50,49 +107,146 @@ def activate_alarm(duration_ms=500):
 wake_button = Pin(4, Pin.IN, Pin.PULL_UP)
 module_on = True  # Global flag for module power state
 
-def check_wake_button():
+def on_wake_gesture(name, gesture, count):
     global module_on
-    if wake_button.value() == 0:
-        press_start = time.ticks_ms()
-        while wake_button.value() == 0:
-            time.sleep_ms(10)
-            if time.ticks_diff(time.ticks_ms(), press_start) > 3000:
-                module_on = not module_on
-                if module_on:
-                    print("Module Woken Up.")
-                else:
-                    print("Module Turned Off.")
-                # Wait for button release to avoid multiple toggles.
-                while wake_button.value() == 0:
-                    time.sleep_ms(10)
-                break
+    if gesture == GESTURE_HOLD:  # Held for 3 s; fires once per hold
+        module_on = not module_on
+        if module_on:
+            print("Module Woken Up.")
+        else:
+            haptic.stop()
+            print("Module Turned Off.")
+
+# The pin IRQ timestamps edges; check_wake_button() only decodes them, so
+# holding the button never stops the radio from being serviced.
+wake_buttons = Buttons(on_wake_gesture)
+wake_buttons.add(wake_button, "wake", hold_ms=3000)
+
+def check_wake_button():
+    wake_buttons.poll()
+
+# ------------------------------
+# IRQ-driven Receive
+# ------------------------------
+# nRF24L01 IRQ output on GPIO10 (active low): falls when a packet lands in the RX FIFO.
+nrf_irq = Pin(10, Pin.IN, Pin.PULL_UP)
+# 0: idle() between packets. >0: lightsleep() for up to this many ms; only use
+# this on ports where a pin IRQ wakes light sleep, otherwise it bounds latency.
+LIGHT_SLEEP_MS = 0
+
+# Receive buffer reused for every packet so the RX loop never allocates
+rx_buf = bytearray(32)  # Room for the largest dynamic payload
+drain_pending = False
+
+# Duplicate suppression: an alert whose ACK was lost is resent with the same
+# sequence number. Only within this window, so a master reboot that happens
+# to reuse the last number is not ignored.
+DUPLICATE_WINDOW_MS = 2000
+last_seq = -1
+last_seq_ms = 0
+duplicates = 0
+
+# Link state: any frame from the master counts as a sign of life
+channel = RENDEZVOUS_CHANNEL
+rf_setup = DEFAULT_RF_SETUP
+# Set by HOP / RADIO frames, applied once the RX FIFO is drained
+hop_channel = None
+rf_pending = None
+last_rx_ms = time.ticks_ms()
+
+def handle_packet(buf, n):
+    global last_alarm_ms, rx_errors, last_seq, last_seq_ms, duplicates, hop_channel, rf_pending, last_rx_ms
+    last_rx_ms = time.ticks_ms()
+    kind = frame_type(buf, n)
+    if kind == FRAME_HOP:
+        hop_channel = frame_arg(buf)
+        return
+    if kind == FRAME_RADIO:
+        rf_pending = frame_arg(buf)
+        return
+    if kind == FRAME_PING:
+        return  # Keepalive; the ACK already carried our telemetry
+    if not module_on:
+        return  # Drop alerts while the module is off so they don't fire on wake
+    if kind == FRAME_ALERT:
+        side = alert_side(buf)
+        seq = alert_seq(buf)
+        if side == EXPECTED_TRIGGER:
+            # Only ACKed alerts are resent; broadcasts are numbered separately
+            now = time.ticks_ms()
+            if seq == last_seq and time.ticks_diff(now, last_seq_ms) < DUPLICATE_WINDOW_MS:
+                duplicates += 1
+                return  # Already acted on this alert
+            last_seq = seq
+            last_seq_ms = now
+        for_us = side & EXPECTED_TRIGGER
+        distance = alert_distance(buf, n, EXPECTED_TRIGGER)  # Our own side's distance in a both-sides alert
+        alert_range = mode_threshold(alert_mode(buf))  # Scale strength to the master's mode
+        print("Alert", seq, "for side", side, "at", distance, "mm")
+    elif kind == 0 and n == 4:
+        # Older masters: same value as struct.unpack("i", ...) for the small positive triggers in use
+        received_trigger = buf[0] | (buf[1] << 8) | (buf[2] << 16) | (buf[3] << 24)
+        for_us = received_trigger == EXPECTED_TRIGGER
+        distance = 0  # No distance in the old format: alarm at full strength
+        alert_range = mode_threshold(0)
+        print("Received trigger:", received_trigger)
+    else:
+        for_us = False
+    led.value(1)
+    if for_us:
+        print("Valid trigger received. Activating alarm.")
+        last_alarm_ms = time.ticks_ms()
+        activate_alarm(distance, alert_range)
+    else:
+        rx_errors += 1
+        print("Trigger does not match expected value.")
+    led.value(0)
 
 def receive(nrf):
+    global hop_channel, rf_pending
+
+    def drain(_):
+        global drain_pending, hop_channel, channel, rf_pending, rf_setup
+        drain_pending = False
+        if nrf.drain_rx(rx_buf, handle_packet):  # Empty the whole 3-deep RX FIFO in one burst
+            load_telemetry(nrf)
+        if hop_channel is not None:
+            # The HOP frame has been ACKed by now, so the master knows we moved
+            channel = hop_channel
+            hop_channel = None
+            retune(nrf, channel)
+            print("Hopped to channel", channel)
+        if rf_pending is not None:
+            rf_setup = rf_pending
+            rf_pending = None
+            set_rf(nrf, rf_setup)
+            print("RF_SETUP now", hex(rf_setup))
+
+    def on_nrf_irq(pin):
+        global drain_pending
+        if not drain_pending:
+            drain_pending = True
+            micropython.schedule(drain, None)
+
+    nrf_irq.irq(trigger=Pin.IRQ_FALLING, handler=on_nrf_irq)
+    drain(None)  # Pick up anything that arrived before the IRQ was attached
     while True:
         check_wake_button()
-        if not module_on:
-            print("Module is off. Waiting to be woken up...")
-            time.sleep(0.5)
-            continue
-
-        if nrf.any():
-            led.value(1)
-            recv_buffer = nrf.recv()  # Receive 4-byte payload
-            try:
-                received_trigger = struct.unpack("i", recv_buffer)[0]
-            except Exception as e:
-                print("Error unpacking data:", e)
-                received_trigger = None
-
-            if received_trigger is not None:
-                print(f"Received trigger: {received_trigger}")
-                if received_trigger == EXPECTED_TRIGGER:
-                    print("Valid trigger received. Activating alarm.")
-                    activate_alarm()
-                else:
-                    print("Trigger does not match expected value.")
-            led.value(0)
-        time.sleep(0.1)
+        if nrf_irq.value() == 0 and not drain_pending:
+            # IRQ is low but no drain is queued: an edge was missed, so catch up
+            on_nrf_irq(None)
+        if ((channel != RENDEZVOUS_CHANNEL or rf_setup != DEFAULT_RF_SETUP)
+                and time.ticks_diff(time.ticks_ms(), last_rx_ms) > LINK_TIMEOUT_MS):
+            if hop_channel is None and rf_pending is None:
+                print("Link lost, going back to the rendezvous settings")
+                # Retune from the scheduler too, so it never lands mid-transfer
+                hop_channel = RENDEZVOUS_CHANNEL
+                rf_pending = DEFAULT_RF_SETUP
+                on_nrf_irq(None)
+        if LIGHT_SLEEP_MS:
+            lightsleep(LIGHT_SLEEP_MS)
+        else:
+            idle()
 # Main execution flow
 if __name__ == "__main__":
     radio = radio_setup()
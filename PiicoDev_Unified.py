@@ -20,8 +20,10 @@ if _SYSNAME == 'microbit':
     
 elif _SYSNAME == 'Linux':
     from smbus2 import SMBus, i2c_msg
+    from ctypes import c_char, POINTER, cast
     from time import sleep
     from math import ceil
+    _I2C_M_RD = 0x0001
     
     def sleep_ms(t):
         sleep(t/1000)
@@ -37,6 +39,14 @@ class I2CBase:
     def readfrom_mem(self, addr, memaddr, nbytes, *, addrsize=8):
         raise NotImplementedError('readfrom_mem')
 
+    def readfrom_mem_into(self, addr, memaddr, buf, *, addrsize=8):
+        buf[:] = bytes(self.readfrom_mem(addr, memaddr, len(buf), addrsize=addrsize))
+
+    def readfrom_mem_into_many(self, reads, *, addrsize=8):
+        # reads: sequence of (addr, memaddr, buf); backends may combine them into one transfer
+        for addr, memaddr, buf in reads:
+            self.readfrom_mem_into(addr, memaddr, buf, addrsize=addrsize)
+
     def write8(self, addr, buf, stop=True):
         raise NotImplementedError('write')
 
@@ -65,6 +75,7 @@ class I2CUnifiedMachine(I2CBase):
 
         self.writeto_mem = self.i2c.writeto_mem
         self.readfrom_mem = self.i2c.readfrom_mem
+        self.readfrom_mem_into = self.i2c.readfrom_mem_into
 
     def write8(self, addr, reg, data):
         if reg is None:
@@ -93,6 +104,11 @@ class I2CUnifiedMicroBit(I2CBase):
         ad = memaddr.to_bytes(addrsize // 8, 'big')  # pad address for eg. 16 bit
         i2c.write(addr, ad, repeat=True)
         return i2c.read(addr, nbytes)    
+
+    def readfrom_mem_into(self, addr, memaddr, buf, *, addrsize=8):
+        ad = memaddr.to_bytes(addrsize // 8, 'big')  # pad address for eg. 16 bit
+        i2c.write(addr, ad, repeat=True)
+        buf[:] = i2c.read(addr, len(buf))  # microbit.i2c has no readinto
     
     def write8(self, addr, reg, data):
         if reg is None:
@@ -127,22 +143,42 @@ class I2CUnifiedLinux(I2CBase):
         self.i2c = SMBus(bus)
 
     def readfrom_mem(self, addr, memaddr, nbytes, *, addrsize=8):
-        data = [None] * nbytes # initialise empty list
-        self.smbus_i2c_read(addr, memaddr, data, nbytes, addrsize=addrsize)
-        return data
+        msg_r = i2c_msg.read(addr, nbytes)
+        self.i2c.i2c_rdwr(self._reg_msg(addr, memaddr, addrsize), msg_r)
+        return bytes(msg_r)
+
+    def readfrom_mem_into(self, addr, memaddr, buf, *, addrsize=8):
+        self.i2c.i2c_rdwr(self._reg_msg(addr, memaddr, addrsize), self._read_into_msg(addr, buf))
+
+    def readfrom_mem_into_many(self, reads, *, addrsize=8):
+        # all register/read message pairs go out in a single I2C_RDWR ioctl
+        msgs = []
+        for addr, memaddr, buf in reads:
+            msgs.append(self._reg_msg(addr, memaddr, addrsize))
+            msgs.append(self._read_into_msg(addr, buf))
+        self.i2c.i2c_rdwr(*msgs)
     
     def writeto_mem(self, addr, memaddr, buf, *, addrsize=8):
         self.smbus_i2c_write(addr, memaddr, buf, len(buf), addrsize=addrsize)
+
+    def _reg_msg(self, address, reg, addrsize):
+        if addrsize == 8:
+            return i2c_msg.write(address, (reg,))
+        elif addrsize == 16:
+            return i2c_msg.write(address, (reg >> 8, reg & 0xff))
+        raise Exception('address must be 8 or 16 bits long only')
+
+    def _read_into_msg(self, address, buf):
+        # the kernel writes straight into buf (a bytearray or writable memoryview)
+        n = len(buf)
+        return i2c_msg(addr=address, flags=_I2C_M_RD, len=n, buf=cast((c_char * n).from_buffer(buf), POINTER(c_char)))
     
     def smbus_i2c_write(self, address, reg, data_p, length, addrsize=8):
         ret_val = 0
-        data = []
-        for index in range(length):
-            data.append(data_p[index])
         if addrsize == 8:
-            msg_w = i2c_msg.write(address, [reg] + data)
+            msg_w = i2c_msg.write(address, bytes((reg,)) + bytes(data_p[:length]))
         elif addrsize == 16:
-            msg_w = i2c_msg.write(address, [reg >> 8, reg & 0xff] + data)
+            msg_w = i2c_msg.write(address, bytes((reg >> 8, reg & 0xff)) + bytes(data_p[:length]))
         else:
             raise Exception('address must be 8 or 16 bits long only')
         self.i2c.i2c_rdwr(msg_w)
@@ -150,17 +186,9 @@ class I2CUnifiedLinux(I2CBase):
         
     def smbus_i2c_read(self, address, reg, data_p, length, addrsize=8):
         ret_val = 0
-        if addrsize == 8:
-            msg_w = i2c_msg.write(address, [reg]) # warning this is set up for 16-bit addresses
-        elif addrsize == 16:
-            msg_w = i2c_msg.write(address, [reg >> 8, reg & 0xff]) # warning this is set up for 16-bit addresses
-        else:
-            raise Exception('address must be 8 or 16 bits long only')
         msg_r = i2c_msg.read(address, length)
-        self.i2c.i2c_rdwr(msg_w, msg_r)
-        if ret_val == 0:
-            for index in range(length):
-                data_p[index] = ord(msg_r.buf[index])
+        self.i2c.i2c_rdwr(self._reg_msg(address, reg, addrsize), msg_r)
+        data_p[:length] = bytes(msg_r)
         return ret_val
     
     def write8(self, addr, reg, data):
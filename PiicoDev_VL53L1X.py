@@ -1,4 +1,5 @@
 from PiicoDev_Unified import *
+from compat import ticks_ms, ticks_diff
 
 compat_str = '\nUnified PiicoDev library out of date.  Get the latest module: https://piico.dev/unified \n'
 
@@ -96,9 +97,105 @@ VL51L1X_DEFAULT_CONFIGURATION = bytes([
 0x40  # 0x87 : start ranging, use StartRanging() or StopRanging(), If you want an automatic start after VL53L1X_init() call, put 0x40 in location 0x87 */
 ])
 
+# Range status codes, kept as small ints on the read path; see status_name()
+STATUS_OK = 0
+STATUS_HARDWARE_FAIL = 1
+STATUS_MIN_RANGE_FAIL = 2
+STATUS_SYNCHRONIZATION_INT = 3
+STATUS_OUT_OF_BOUNDS_FAIL = 4
+STATUS_SIGNAL_FAIL = 5
+STATUS_WRAP_TARGET_FAIL = 6
+STATUS_XTALK_SIGNAL_FAIL = 7
+STATUS_RANGE_VALID_MIN_RANGE_CLIPPED = 8
+STATUS_RANGE_VALID_NO_WRAP_CHECK_FAIL = 9
+STATUS_UNKNOWN = 10
+
+STATUS_NAMES = (
+    "OK",
+    "HardwareFail",
+    "MinRangeFail",
+    "SynchronizationInt",
+    "OutOfBoundsFail",
+    "SignalFail",
+    "WrapTargetFail",
+    "XtalkSignalFail",
+    "RangeValidMinRangeClipped",
+    "RangeValidNoWrapCheckFail",
+    "Unknown",
+)
+
+# RESULT__RANGE_STATUS (low 5 bits) -> status code
+_RANGE_STATUS_LUT = bytes([
+    STATUS_UNKNOWN,                 # 0
+    STATUS_HARDWARE_FAIL,           # 1
+    STATUS_HARDWARE_FAIL,           # 2
+    STATUS_HARDWARE_FAIL,           # 3
+    STATUS_SIGNAL_FAIL,             # 4
+    STATUS_OUT_OF_BOUNDS_FAIL,      # 5
+    STATUS_SIGNAL_FAIL,             # 6
+    STATUS_WRAP_TARGET_FAIL,        # 7
+    STATUS_RANGE_VALID_MIN_RANGE_CLIPPED, # 8
+    STATUS_OK,                      # 9, downgraded when stream count is 0
+    STATUS_UNKNOWN,                 # 10
+    STATUS_UNKNOWN,                 # 11
+    STATUS_XTALK_SIGNAL_FAIL,       # 12
+    STATUS_MIN_RANGE_FAIL,          # 13
+    STATUS_UNKNOWN,                 # 14
+    STATUS_UNKNOWN,                 # 15
+    STATUS_UNKNOWN,                 # 16
+    STATUS_HARDWARE_FAIL,           # 17
+    STATUS_SYNCHRONIZATION_INT,     # 18
+]) + bytes([STATUS_UNKNOWN] * 13)
+
+DISTANCE_MODE_SHORT = 1 # up to ~1.3 m, better ambient immunity
+DISTANCE_MODE_LONG = 2  # up to ~4 m, the default configuration
+
+# SYSTEM__INTERRUPT_CONFIG_GPIO window modes for set_distance_threshold()
+WINDOW_BELOW = 0 # distance < low
+WINDOW_ABOVE = 1 # distance > high
+WINDOW_OUT = 2   # distance < low or distance > high
+WINDOW_IN = 3    # low <= distance <= high
+
+# timing budget in ms -> (RANGE_CONFIG__TIMEOUT_MACROP_A, RANGE_CONFIG__TIMEOUT_MACROP_B)
+_TIMING_BUDGET_SHORT = {
+    15: (0x001D, 0x0027),
+    20: (0x0051, 0x006E),
+    33: (0x00D6, 0x006E),
+    50: (0x01AE, 0x01E8),
+    100: (0x02E1, 0x0388),
+    200: (0x03E1, 0x0496),
+    500: (0x0591, 0x05C1),
+}
+_TIMING_BUDGET_LONG = {
+    20: (0x001E, 0x0022),
+    33: (0x0060, 0x006E),
+    50: (0x00AD, 0x00C6),
+    100: (0x01CC, 0x01EA),
+    200: (0x02D9, 0x02F8),
+    500: (0x048F, 0x04A4),
+}
+# set_distance_mode() applies this when no budget was set: the closest entry
+# to the default configuration's timeouts (0x01DB, 0x01F1)
+_DEFAULT_TIMING_BUDGET = 100
+
+_NAN = float('NaN')
+_CLEAR_INTERRUPT = b'\x01'
+_START_RANGING = b'\x40'
+_STOP_RANGING = b'\x00'
+
+
+def status_name(code):
+    return None if code is None else STATUS_NAMES[code]
+
+def roi_center_spad(col, row):
+    """SPAD number at col, row (0-15, row 0 at the top of ST's SPAD map) for use as an ROI centre."""
+    if row < 8:
+        return 128 + 8 * col + row
+    return 127 - 8 * col - (row - 8)
+
 
 class PiicoDev_VL53L1X:
-    def __init__(self, bus=None, freq=None, sda=None, scl=None, address=0x29):
+    def __init__(self, bus=None, freq=None, sda=None, scl=None, address=0x29, i2c=None, warm=True):
         try:
             if compat_ind >= 1:
                 pass
@@ -106,9 +203,25 @@ class PiicoDev_VL53L1X:
                 print(compat_str)
         except:
             print(compat_str)
-        self.i2c = create_unified_i2c(bus=bus, freq=freq, sda=sda, scl=scl)
+        # an existing unified I2C object may be shared between sensors on one bus
+        self.i2c = i2c if i2c is not None else create_unified_i2c(bus=bus, freq=freq, sda=sda, scl=scl)
         self.addr = address
-        self.status = None
+        self.status_code = None
+        self.distance_mode = DISTANCE_MODE_LONG
+        self.timing_budget = None # None until set_timing_budget() or set_distance_mode(); the default configuration applies
+        # settings restored by restore_settings() after a cold re-initialisation
+        self.inter_measurement = None
+        self.threshold = None
+        self.roi_size = None
+        # buffers owned by the sensor so the read path never allocates
+        self._status_buf = bytearray(3) # RESULT__RANGE_STATUS .. RESULT__STREAM_COUNT
+        self._range_buf = bytearray(2)  # RESULT__FINAL_CROSSTALK_CORRECTED_RANGE_MM_SD0
+        self._reg_buf = bytearray(1)
+        self._wr_buf = bytearray(1)
+        self._build_result_reads()
+        # a sensor that kept its configuration (e.g. across an MCU soft reset) skips the cold start
+        if warm and self.warm_init():
+            return
         self.reset()
         sleep_ms(1)
         if self.read_model_id() != 0xEACC:
@@ -120,11 +233,17 @@ class PiicoDev_VL53L1X:
         # measurement is started; assumes MM1 and MM2 are disabled
         self.writeReg16Bit(0x001E, self.readReg16Bit(0x0022) * 4)
         sleep_ms(200)
+        # GPIO__HV_MUX__CTRL bit 4 selects the interrupt polarity; the data-ready
+        # bit in GPIO__TIO_HV_STATUS reads as the inverse of it
+        self.int_pol = 0 if self.readReg(0x0030) & 0x10 else 1
+        self.clear_interrupt()
 
     def writeReg(self, reg, value):
         return self.i2c.writeto_mem(self.addr, reg, bytes([value]), addrsize=16)
     def writeReg16Bit(self, reg, value):
         return self.i2c.writeto_mem(self.addr, reg, bytes([(value >> 8) & 0xFF, value & 0xFF]), addrsize=16)
+    def writeReg32Bit(self, reg, value):
+        return self.i2c.writeto_mem(self.addr, reg, bytes([(value >> 24) & 0xFF, (value >> 16) & 0xFF, (value >> 8) & 0xFF, value & 0xFF]), addrsize=16)
     def readReg(self, reg):
         return self.i2c.readfrom_mem(self.addr, reg, 1, addrsize=16)[0]
     def readReg16Bit(self, reg):
@@ -137,49 +256,203 @@ class PiicoDev_VL53L1X:
         sleep_ms(100)
         self.writeReg(0x0000, 0x01)
     
+    def booted(self):
+        return bool(self.readReg(0x00E5) & 0x01) # FIRMWARE__SYSTEM_STATUS
+
+    def is_configured(self):
+        """
+        True if the sensor still holds the configuration written by this driver:
+        the sigma/signal thresholds match the default configuration and the
+        outer offset has been derived from the inner one.
+        """
+        if not self.booted() or self.read_model_id() != 0xEACC:
+            return False
+        if bytes(self.i2c.readfrom_mem(self.addr, 0x0064, 4, addrsize=16)) != VL51L1X_DEFAULT_CONFIGURATION[0x64 - 0x2D:0x68 - 0x2D]:
+            return False
+        inner = self.readReg16Bit(0x0022)
+        return inner != 0 and self.readReg16Bit(0x001E) == (inner * 4) & 0xFFFF
+
+    def warm_init(self):
+        """
+        Reuse a sensor that is already configured: restart ranging without the
+        reset, configuration upload or settling delays. Returns False (leaving
+        the sensor untouched) if it needs a cold start or does not answer.
+        """
+        try:
+            if not self.is_configured():
+                return False
+            self.stop_ranging()
+            self.distance_mode = DISTANCE_MODE_SHORT if self.readReg(0x004B) == 0x14 else DISTANCE_MODE_LONG
+            self.int_pol = 0 if self.readReg(0x0030) & 0x10 else 1
+            self.clear_interrupt()
+            self.start_ranging()
+        except OSError:
+            return False
+        return True
+
+    def upload_config(self):
+        """Write the default configuration without settling delays; ranging starts immediately."""
+        self.i2c.writeto_mem(self.addr, 0x2D, VL51L1X_DEFAULT_CONFIGURATION, addrsize=16)
+        self.writeReg16Bit(0x001E, self.readReg16Bit(0x0022) * 4)
+        self.int_pol = 0 if self.readReg(0x0030) & 0x10 else 1
+        self.clear_interrupt()
+
+    def restore_settings(self):
+        """Re-apply distance mode, timing, threshold and ROI size after upload_config()."""
+        self.stop_ranging()
+        self.set_distance_mode(self.distance_mode)
+        if self.inter_measurement is not None:
+            self.set_inter_measurement(self.inter_measurement)
+        if self.threshold is not None:
+            self.set_distance_threshold(*self.threshold)
+        if self.roi_size is not None:
+            self.set_roi(*self.roi_size)
+        self.clear_interrupt()
+        self.start_ranging()
+
     def read(self):
         try:
-            data = self.i2c.readfrom_mem(self.addr, 0x0089, 17, addrsize=16) # RESULT__RANGE_STATUS
+            self.i2c.readfrom_mem_into_many(self._result_reads, addrsize=16)
         except:
             print(i2c_err_str.format(self.addr))
-            return float('NaN')
-        range_status = data[0]
-        # report_status = data[1]
-        stream_count = data[2]
-        dss_actual_effective_spads_sd0 = (data[3]<<8) + data[4]
-        # peak_signal_count_rate_mcps_sd0 = (data[5]<<8) + data[6]
-        ambient_count_rate_mcps_sd0 = (data[7]<<8) + data[8]
-        # sigma_sd0 = (data[9]<<8) + data[10]
-        # phase_sd0 = (data[11]<<8) + data[12]
-        final_crosstalk_corrected_range_mm_sd0 = (data[13]<<8) + data[14]
-        peak_signal_count_rate_crosstalk_corrected_mcps_sd0 = (data[15]<<8) + data[16]
-        status = None
-        if range_status in (17, 2, 1, 3):
-            self.status = "HardwareFail"
-        elif range_status == 13:
-            self.status = "MinRangeFail"
-        elif range_status == 18:
-            self.status = "SynchronizationInt"
-        elif range_status == 5:
-            self.status = "OutOfBoundsFail"
-        elif range_status == 4:
-            self.status = "SignalFail"
-        elif range_status == 6:
-            self.status = "SignalFail"
-        elif range_status == 7:
-            self.status = "WrapTargetFail"
-        elif range_status == 12:
-            self.status = "XtalkSignalFail"
-        elif range_status == 8:
-            self.status = "RangeValidMinRangeClipped"
-        elif range_status == 9:
-            if stream_count == 0:
-                self.status = "RangeValidNoWrapCheckFail"
-            else:
-                self.status = "OK"
-        return final_crosstalk_corrected_range_mm_sd0
+            return _NAN
+        code = _RANGE_STATUS_LUT[self._status_buf[0] & 0x1F]
+        if code == STATUS_OK and self._status_buf[2] == 0: # stream count
+            code = STATUS_RANGE_VALID_NO_WRAP_CHECK_FAIL
+        self.status_code = code
+        return (self._range_buf[0] << 8) | self._range_buf[1]
     
+    def start_ranging(self):
+        self.i2c.writeto_mem(self.addr, 0x0087, _START_RANGING, addrsize=16) # SYSTEM__MODE_START: continuous ranging
+    def stop_ranging(self):
+        self.i2c.writeto_mem(self.addr, 0x0087, _STOP_RANGING, addrsize=16)
+    def clear_interrupt(self):
+        self.i2c.writeto_mem(self.addr, 0x0086, _CLEAR_INTERRUPT, addrsize=16) # SYSTEM__INTERRUPT_CLEAR
+    def data_ready(self):
+        self.i2c.readfrom_mem_into(self.addr, 0x0031, self._reg_buf, addrsize=16) # GPIO__TIO_HV_STATUS
+        return (self._reg_buf[0] & 0x01) == self.int_pol
+
+    def set_distance_mode(self, mode=DISTANCE_MODE_LONG):
+        """
+        Select DISTANCE_MODE_SHORT or DISTANCE_MODE_LONG. Stop ranging before calling.
+        The timing budget is re-applied for the new VCSEL periods (100 ms if none was set);
+        the sensor is left untouched if the current budget is not available in mode.
+        """
+        if mode == DISTANCE_MODE_SHORT:
+            table = _TIMING_BUDGET_SHORT
+        elif mode == DISTANCE_MODE_LONG:
+            table = _TIMING_BUDGET_LONG
+        else:
+            raise ValueError('distance mode must be DISTANCE_MODE_SHORT or DISTANCE_MODE_LONG')
+        budget = self.timing_budget if self.timing_budget is not None else _DEFAULT_TIMING_BUDGET
+        if budget not in table:
+            raise ValueError('timing budget {} ms is not available in that distance mode; change it first'.format(budget))
+        if mode == DISTANCE_MODE_SHORT:
+            self.writeReg(0x004B, 0x14)         # PHASECAL_CONFIG__TIMEOUT_MACROP
+            self.writeReg(0x0060, 0x07)         # RANGE_CONFIG__VCSEL_PERIOD_A
+            self.writeReg(0x0063, 0x05)         # RANGE_CONFIG__VCSEL_PERIOD_B
+            self.writeReg(0x0069, 0x38)         # RANGE_CONFIG__VALID_PHASE_HIGH
+            self.writeReg16Bit(0x0078, 0x0705)  # SD_CONFIG__WOI_SD0
+            self.writeReg16Bit(0x007A, 0x0606)  # SD_CONFIG__INITIAL_PHASE_SD0
+        else:
+            self.writeReg(0x004B, 0x0A)
+            self.writeReg(0x0060, 0x0F)
+            self.writeReg(0x0063, 0x0D)
+            self.writeReg(0x0069, 0xB8)
+            self.writeReg16Bit(0x0078, 0x0F0D)
+            self.writeReg16Bit(0x007A, 0x0E0E)
+        self.distance_mode = mode
+        # the macro-period timeouts depend on the VCSEL periods, so re-apply the budget
+        self.set_timing_budget(budget)
+
+    def set_timing_budget(self, ms):
+        """Set the ranging timing budget in ms (15 is short mode only). Stop ranging before calling."""
+        table = _TIMING_BUDGET_SHORT if self.distance_mode == DISTANCE_MODE_SHORT else _TIMING_BUDGET_LONG
+        if ms not in table:
+            raise ValueError('timing budget must be one of {} ms in this distance mode'.format(sorted(table)))
+        timeout_a, timeout_b = table[ms]
+        self.writeReg16Bit(0x005E, timeout_a) # RANGE_CONFIG__TIMEOUT_MACROP_A_HI
+        self.writeReg16Bit(0x0061, timeout_b) # RANGE_CONFIG__TIMEOUT_MACROP_B_HI
+        self.timing_budget = ms
+
+    def set_inter_measurement(self, ms):
+        """Set the period between continuous measurements in ms; must be >= the timing budget."""
+        if self.timing_budget is not None and ms < self.timing_budget:
+            raise ValueError('inter-measurement period must be at least the timing budget')
+        clock_pll = self.readReg16Bit(0x00DE) & 0x3FF # RESULT__OSC_CALIBRATE_VAL
+        self.writeReg32Bit(0x006C, int(clock_pll * ms * 1.075)) # SYSTEM__INTERMEASUREMENT_PERIOD
+        self.inter_measurement = ms
+
+    def set_distance_threshold(self, low, high, window=WINDOW_BELOW, int_on_no_target=False):
+        """Only raise GPIO1/data-ready when the measured distance (mm) satisfies window."""
+        config = window & 0x07
+        if int_on_no_target:
+            config |= 0x40
+        self.writeReg(0x0046, config)       # SYSTEM__INTERRUPT_CONFIG_GPIO
+        self.writeReg16Bit(0x0072, high)    # SYSTEM__THRESH_HIGH
+        self.writeReg16Bit(0x0074, low)     # SYSTEM__THRESH_LOW
+        self.threshold = (low, high, window, int_on_no_target)
+
+    def clear_distance_threshold(self):
+        self.writeReg(0x0046, 0x20) # back to an interrupt on every new sample
+        self.threshold = None
+
+    def set_roi(self, width=16, height=16):
+        """Set the receiving SPAD region to width x height (4-16 each); see set_roi_center()."""
+        width = min(max(width, 4), 16)
+        height = min(max(height, 4), 16)
+        self.writeReg(0x0080, ((height - 1) << 4) | (width - 1)) # ROI_CONFIG__USER_ROI_REQUESTED_GLOBAL_XY_SIZE
+        self.roi_size = (width, height)
+
+    def set_roi_center(self, spad):
+        """Centre the ROI on a SPAD number (see roi_center_spad()); 199 is the optical centre."""
+        self._wr_buf[0] = spad
+        self.i2c.writeto_mem(self.addr, 0x007F, self._wr_buf, addrsize=16) # ROI_CONFIG__USER_ROI_CENTRE_SPAD
+
+    @property
+    def status(self):
+        return status_name(self.status_code)
+
+    def read_if_ready(self):
+        """Return a new distance in mm, or None if no new sample is available yet.
+
+        The interrupt is cleared after the result is read so the sensor can
+        latch the next measurement.
+        """
+        try:
+            if not self.data_ready():
+                return None
+        except:
+            print(i2c_err_str.format(self.addr))
+            return _NAN
+        distance = self.read()
+        try:
+            self.clear_interrupt()
+        except:
+            print(i2c_err_str.format(self.addr))
+            return _NAN
+        return distance
+
+    def wait_ready(self, timeout=1000):
+        """Block for up to timeout ms for a new sample; returns None on timeout."""
+        start = ticks_ms()
+        while True:
+            distance = self.read_if_ready()
+            if distance is not None:
+                return distance
+            if ticks_diff(ticks_ms(), start) >= timeout:
+                return None
+            sleep_ms(1)
+
+    def _build_result_reads(self):
+        # one batched transfer per sample (a single ioctl on Linux)
+        self._result_reads = (
+            (self.addr, 0x0089, self._status_buf), # RESULT__RANGE_STATUS
+            (self.addr, 0x0096, self._range_buf),  # RESULT__FINAL_CROSSTALK_CORRECTED_RANGE_MM_SD0
+        )
+
     def change_addr(self, new_addr):
         self.writeReg(0x0001, new_addr & 0x7F)
         sleep_ms(50)
         self.addr = new_addr
+        self._build_result_reads()
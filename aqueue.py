@@ -0,0 +1,49 @@
+# aqueue.py
+# Small bounded queue for asyncio tasks; MicroPython's asyncio has no Queue.
+from compat import asyncio
+
+
+class Queue:
+    """
+    Fixed-capacity FIFO with a single consumer. When full, put_nowait()
+    discards the oldest item (counted in dropped) so producers never block
+    and consumers always see the newest data.
+    """
+
+    def __init__(self, maxsize):
+        self._items = [None] * maxsize
+        self._head = 0
+        self._count = 0
+        self._event = asyncio.Event()
+        self.dropped = 0
+
+    def qsize(self):
+        return self._count
+
+    def empty(self):
+        return self._count == 0
+
+    def put_nowait(self, item):
+        size = len(self._items)
+        if self._count == size:
+            self._head = (self._head + 1) % size
+            self._count -= 1
+            self.dropped += 1
+        self._items[(self._head + self._count) % size] = item
+        self._count += 1
+        self._event.set()
+
+    def get_nowait(self):
+        if not self._count:
+            raise IndexError('queue empty')
+        item = self._items[self._head]
+        self._items[self._head] = None
+        self._head = (self._head + 1) % len(self._items)
+        self._count -= 1
+        return item
+
+    async def get(self):
+        while not self._count:
+            self._event.clear()
+            await self._event.wait()
+        return self.get_nowait()
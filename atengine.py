@@ -0,0 +1,153 @@
+# atengine.py
+# Line-oriented AT command engine for the GSM modem UART. Works with any
+# object that has any(), read(n) and write(buf), so it also runs on Linux
+# against a fake UART.
+from compat import asyncio, ticks_ms, ticks_diff
+
+RESULT_OK = "OK"
+RESULT_ERROR = "ERROR"
+RESULT_TIMEOUT = "TIMEOUT"
+
+# Final result codes that end a command
+_FINAL_OK = (b"OK",)
+_FINAL_ERROR = (b"ERROR", b"NO CARRIER", b"BUSY", b"NO ANSWER", b"NO DIALTONE")
+_ERROR_PREFIXES = (b"+CME ERROR", b"+CMS ERROR")
+
+POLL_MS = 5
+
+
+async def _sleep_ms(ms):
+    if hasattr(asyncio, "sleep_ms"):
+        await asyncio.sleep_ms(ms)
+    else:
+        await asyncio.sleep(ms / 1000)
+
+
+def _is_error(line):
+    for prefix in _ERROR_PREFIXES:
+        if line.startswith(prefix):
+            return True
+    return False
+
+
+def response_prefix(cmd):
+    """b'+CMGS' for 'AT+CMGS="..."': the prefix of the command's own response lines."""
+    if not cmd.startswith("AT+"):
+        return None
+    end = len(cmd)
+    for ch in "=?":
+        i = cmd.find(ch)
+        if 0 <= i < end:
+            end = i
+    return cmd[2:end].encode()
+
+
+class ATEngine:
+    """
+    Runs one AT command at a time and parses the modem's output line by
+    line as it arrives.
+
+    command() returns as soon as a final result code (OK, ERROR, +CME/+CMS
+    ERROR, ...) is seen or its timeout expires, with the information lines
+    that came back. If data is given it is written when the '>' prompt
+    appears, as AT+CMGS needs. Lines that are not part of the running
+    command's response and start with a prefix registered with on() are
+    unsolicited result codes and go to that handler; run() keeps reading
+    between commands so URCs are never left in the UART buffer.
+    """
+
+    def __init__(self, uart):
+        self.uart = uart
+        self._buf = b""
+        self._urc = []          # (prefix, handler)
+        self._lock = asyncio.Lock()
+        self._active = None     # command text while one is running
+        self._prefix = None
+        self._prompt_data = None
+        self._lines = []
+        self._result = None
+        self.unsolicited = 0    # URC lines that had no handler
+        self.timeouts = 0
+
+    def on(self, prefix, handler):
+        """Call handler(line) for each unsolicited line starting with prefix (bytes)."""
+        self._urc.append((prefix, handler))
+
+    def poll(self):
+        """Read what the UART has and dispatch complete lines; returns bytes read."""
+        n = self.uart.any()
+        if not n:
+            return 0
+        data = self.uart.read(n)
+        if not data:
+            return 0
+        buf = self._buf + data
+        while True:
+            i = buf.find(b"\n")
+            if i < 0:
+                break
+            line = buf[:i].strip()
+            buf = buf[i + 1:]
+            if line:
+                self._line(line)
+        if self._prompt_data is not None and buf[:1] == b">":
+            # the prompt has no line ending; send the payload right away
+            buf = b""
+            self.uart.write(self._prompt_data)
+            self._prompt_data = None
+        self._buf = buf
+        return len(data)
+
+    def _line(self, line):
+        if self._active is not None:
+            if line in _FINAL_OK:
+                self._result = RESULT_OK
+                return
+            if line in _FINAL_ERROR or _is_error(line):
+                self._lines.append(line)
+                self._result = RESULT_ERROR
+                return
+            if self._prefix is not None and line.startswith(self._prefix + b":"):
+                self._lines.append(line)
+                return
+        for prefix, handler in self._urc:
+            if line.startswith(prefix):
+                handler(line)
+                return
+        if self._active is None:
+            self.unsolicited += 1
+        elif not line.startswith(b"AT"):  # skip the command echo
+            self._lines.append(line)
+
+    async def command(self, cmd, timeout_ms=1000, data=None):
+        """Run cmd; returns (RESULT_OK / RESULT_ERROR / RESULT_TIMEOUT, [lines])."""
+        async with self._lock:
+            self.poll()  # URCs that arrived before the command are not its response
+            self._lines = []
+            self._result = None
+            self._prefix = response_prefix(cmd)
+            self._prompt_data = data
+            self._active = cmd
+            self.uart.write(cmd.encode() + b"\r\n")
+            start = ticks_ms()
+            try:
+                while True:
+                    self.poll()
+                    if self._result is not None:
+                        return self._result, self._lines
+                    if ticks_diff(ticks_ms(), start) >= timeout_ms:
+                        self.timeouts += 1
+                        if data is not None:
+                            self.uart.write(b"\x1b")  # leave the '>' prompt without sending
+                        return RESULT_TIMEOUT, self._lines
+                    await _sleep_ms(POLL_MS)
+            finally:
+                self._active = None
+                self._prompt_data = None
+
+    async def run(self, interval_ms=50):
+        """Keep URCs flowing while no command is running."""
+        while True:
+            if self._active is None:
+                self.poll()
+            await _sleep_ms(interval_ms)
@@ -0,0 +1,91 @@
+# buttons.py
+# Interrupt-driven push buttons: pin IRQs timestamp every edge into a ring,
+# and a non-blocking decoder turns the edges into press and hold gestures.
+from machine import Pin
+from ringbuf import SampleRing
+import time
+
+GESTURE_PRESS = "press"  # released after count short presses in a row
+GESTURE_HOLD = "hold"    # held for hold_ms; fires while still held
+
+DEBOUNCE_MS = 30
+
+
+class Buttons:
+    """
+    Decodes gestures for up to 127 buttons sharing one edge ring.
+
+    Each IRQ pushes (button << 1 | pressed) and the low 16 bits of
+    ticks_ms into the ring and nothing else, so a held button costs nothing
+    between its edges. poll() replays the edges and calls
+    on_gesture(name, gesture, count). Presses closer together than gap_ms
+    are counted into one GESTURE_PRESS, reported gap_ms after the last
+    release; with gap_ms=0 every press is reported on release. Holding for
+    hold_ms reports GESTURE_HOLD once and the release that follows is not a
+    press.
+    """
+
+    def __init__(self, on_gesture, size=32):
+        self.on_gesture = on_gesture
+        self._edges = SampleRing(size)
+        self._buttons = []  # [pin, name, active level, hold_ms, gap_ms]
+        self._state = []    # [pressed, last edge, press start, presses, last release, held]
+
+    def add(self, pin, name, hold_ms=3000, gap_ms=600, active_low=True):
+        index = len(self._buttons)
+        active = 0 if active_low else 1
+        self._buttons.append([pin, name, active, hold_ms, gap_ms])
+        self._state.append([False, 0, 0, 0, 0, False])
+
+        def on_edge(p):
+            pressed = 1 if p.value() == active else 0
+            self._edges.push((index << 1) | pressed, time.ticks_ms() & 0xFFFF)
+
+        pin.irq(trigger=Pin.IRQ_FALLING | Pin.IRQ_RISING, handler=on_edge)
+        return index
+
+    def poll(self):
+        """Decode queued edges and due gestures; call often, it never blocks."""
+        now = time.ticks_ms()
+        while True:
+            edge = self._edges.pop()
+            if edge < 0:
+                break
+            # rebuild a full tick count from the 16-bit stamp
+            stamp = time.ticks_add(now, -((now - edge) & 0xFFFF))
+            self._edge(edge >> 17, (edge >> 16) & 1, stamp)
+        for index in range(len(self._buttons)):
+            self._check(index, now)
+
+    def _edge(self, index, pressed, stamp):
+        state = self._state[index]
+        if time.ticks_diff(stamp, state[1]) < DEBOUNCE_MS or bool(pressed) == state[0]:
+            return  # contact bounce, or a level we already have
+        state[1] = stamp
+        if pressed:
+            state[0] = True
+            state[2] = stamp
+            state[5] = False
+            return
+        state[0] = False
+        if state[5]:
+            return  # the end of a hold, not a press
+        state[3] += 1
+        state[4] = stamp
+
+    def _check(self, index, now):
+        pin, name, active, hold_ms, gap_ms = self._buttons[index]
+        state = self._state[index]
+        level = pin.value() == active
+        if level != state[0] and time.ticks_diff(now, state[1]) >= DEBOUNCE_MS:
+            # an edge lost in the bounce filter; the settled pin level is the truth
+            self._edge(index, level, now)
+        if state[0]:
+            if not state[5] and time.ticks_diff(now, state[2]) >= hold_ms:
+                state[5] = True
+                state[3] = 0
+                self.on_gesture(name, GESTURE_HOLD, 1)
+        elif state[3] and time.ticks_diff(now, state[4]) >= gap_ms:
+            count = state[3]
+            state[3] = 0
+            self.on_gesture(name, GESTURE_PRESS, count)
@@ -0,0 +1,22 @@
+# compat.py
+# asyncio and the time.ticks_* functions under one import, with stand-ins so
+# the modules that use them also run under CPython (Raspberry Pi test rig,
+# fake-UART tests).
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
+
+try:
+    from time import ticks_ms, ticks_diff, ticks_add
+except ImportError:
+    from time import monotonic
+
+    def ticks_ms():
+        return int(monotonic() * 1000)
+
+    def ticks_diff(a, b):
+        return a - b
+
+    def ticks_add(a, b):
+        return a + b
@@ -0,0 +1,70 @@
+# gnss.py
+# Keeps the last GNSS fix from the EC200U so an SOS can include it without
+# waiting for the receiver.
+from atengine import RESULT_OK
+from compat import asyncio, ticks_ms, ticks_diff
+
+
+class GnssTracker:
+    """
+    Turns the modem's GNSS engine on (AT+QGPS=1) and reads a fix with
+    AT+QGPSLOC=2 every interval_ms, or every search_ms until the first fix.
+    Each query is a single short AT command, so it never holds the modem
+    for long ahead of an SOS. lat and lon are the decimal-degree strings the
+    modem reported; they are kept, with the time of the fix, when later
+    queries have no fix.
+    """
+
+    def __init__(self, at, interval_ms=60000, search_ms=15000):
+        self.at = at
+        self.interval_ms = interval_ms
+        self.search_ms = search_ms
+        self.enabled = False
+        self.lat = None
+        self.lon = None
+        self.fix_ms = None
+
+    def age_s(self):
+        """Seconds since the cached fix, or None if there has never been one."""
+        if self.fix_ms is None:
+            return None
+        return ticks_diff(ticks_ms(), self.fix_ms) // 1000
+
+    def describe(self):
+        """One line for an SMS: a map link and the fix age."""
+        age = self.age_s()
+        if age is None:
+            return "Location: unknown"
+        if age < 120:
+            when = "{} s ago".format(age)
+        else:
+            when = "{} min ago".format(age // 60)
+        return "Location ({}): https://maps.google.com/?q={},{}".format(when, self.lat, self.lon)
+
+    async def enable(self):
+        result, lines = await self.at.command("AT+QGPS=1")
+        # +CME ERROR: 504 means the session is already running
+        self.enabled = result == RESULT_OK or (bool(lines) and lines[-1].endswith(b"504"))
+        return self.enabled
+
+    async def update(self):
+        """Query the receiver once; returns True if a new fix was cached."""
+        if not self.enabled and not await self.enable():
+            return False
+        result, lines = await self.at.command("AT+QGPSLOC=2")
+        if result != RESULT_OK or not lines:
+            return False  # +CME ERROR: 516 until the receiver has a fix
+        # +QGPSLOC: <UTC>,<lat>,<lon>,<hdop>,<alt>,<fix>,<cog>,<spkm>,<spkn>,<date>,<nsat>
+        fields = lines[0][lines[0].find(b":") + 1:].strip().split(b",")
+        if len(fields) < 3:
+            return False
+        self.lat = fields[1].decode()
+        self.lon = fields[2].decode()
+        self.fix_ms = ticks_ms()
+        return True
+
+    async def run(self):
+        while True:
+            await self.update()
+            wait = self.interval_ms if self.fix_ms is not None else self.search_ms
+            await asyncio.sleep(wait / 1000)
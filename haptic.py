@@ -0,0 +1,94 @@
+# haptic.py
+# Non-blocking buzzer/vibration patterns for the slaves, stepped from a
+# machine.Timer so the radio keeps being serviced while an alert plays.
+from machine import PWM, Timer
+
+# A pattern is a bytes object of steps, played in a loop until the alert's
+# duration runs out. Each step byte is:
+#   high nibble: level 0-15 (0 = off), scaled by the alert's intensity
+#   low nibble : length in units 1-15; a unit shrinks as the obstacle gets closer
+PATTERN_PULSE = b"\xf2\x02"          # even on/off pulses
+PATTERN_DOUBLE = b"\xf1\x01\xf1\x04"  # two short pulses, then a gap
+PATTERN_CONTINUOUS = b"\xff"          # steady output
+
+TICK_MS = 10
+UNIT_FAR_MS = 80     # unit length at the edge of the alert range
+UNIT_NEAR_MS = 20    # unit length with the obstacle right in front
+MIN_DUTY = 0x4000    # weakest output that still reliably spins the motor
+
+
+class Haptic:
+    """
+    Drives a buzzer and a vibration motor through PWM.
+
+    play() returns at once. A new alert pre-empts whatever is playing; if it
+    uses the same pattern the rhythm carries on and only the intensity, pulse
+    rate and end time are updated. Closer obstacles give stronger output and
+    shorter units. The timer callback does not allocate, so it is also safe
+    on ports where timer callbacks run in hard IRQ context.
+    """
+
+    def __init__(self, buzzer, motor, timer_id=0, buzzer_freq=2000, motor_freq=1000):
+        self._buzzer = PWM(buzzer)
+        self._buzzer.freq(buzzer_freq)
+        self._motor = PWM(motor)
+        self._motor.freq(motor_freq)
+        self._timer = Timer(timer_id)
+        self._tick_cb = self._tick  # bind once; the timer must not allocate
+        self._pattern = None
+        self._index = 0
+        self._step_left = 0
+        self._remaining = 0
+        self._unit = 1
+        self._duty = 0
+        self._active = False
+        self._output(0)
+
+    def playing(self):
+        return self._active
+
+    def play(self, pattern, distance_mm=0, range_mm=2000, duration_ms=500):
+        # strength 0-256: 256 at 0 mm, 0 at range_mm and beyond
+        if distance_mm >= range_mm:
+            strength = 0
+        else:
+            strength = 256 - distance_mm * 256 // range_mm
+        unit_ms = UNIT_FAR_MS - (UNIT_FAR_MS - UNIT_NEAR_MS) * strength // 256
+        self._unit = max(1, unit_ms // TICK_MS)
+        self._duty = MIN_DUTY + (0xFFFF - MIN_DUTY) * strength // 256
+        self._remaining = max(1, duration_ms // TICK_MS)
+        if self._active and pattern is self._pattern:
+            return  # update in place, the next step picks up the new values
+        self._pattern = pattern
+        self._index = 0
+        self._next_step()
+        if not self._active:
+            self._active = True
+            self._timer.init(period=TICK_MS, mode=Timer.PERIODIC, callback=self._tick_cb)
+
+    def stop(self):
+        self._timer.deinit()
+        self._active = False
+        self._output(0)
+
+    def _tick(self, timer):
+        self._remaining -= 1
+        if self._remaining <= 0:
+            self.stop()
+            return
+        self._step_left -= 1
+        if self._step_left <= 0:
+            self._next_step()
+
+    def _next_step(self):
+        pattern = self._pattern
+        if self._index >= len(pattern):
+            self._index = 0
+        step = pattern[self._index]
+        self._index += 1
+        self._output(self._duty * (step >> 4) // 15)
+        self._step_left = max(1, step & 0x0F) * self._unit
+
+    def _output(self, duty):
+        self._buzzer.duty_u16(duty)
+        self._motor.duty_u16(duty)
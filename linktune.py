@@ -0,0 +1,78 @@
+# linktune.py
+# Picks nRF24L01 retry and RF settings from observed retransmit counts.
+# Pure bookkeeping: LinkManager (nrfmaster.py) applies what it decides.
+from nrf24l01 import SPEED_250K, SPEED_1M, SPEED_2M, POWER_2, POWER_3
+
+# (speed, power, retry delay us, retry count), most robust first. Delays
+# leave room for the 6-byte telemetry ACK payload at each rate.
+PROFILES = (
+    (SPEED_250K, POWER_3, 1500, 15),
+    (SPEED_1M, POWER_3, 1000, 10),
+    (SPEED_1M, POWER_3, 500, 5),
+    (SPEED_2M, POWER_3, 500, 3),
+    (SPEED_2M, POWER_2, 500, 3),
+)
+DEFAULT_PROFILE = 2  # the 1 Mbps, 0 dBm link radio_setup() starts with
+
+
+def send_timeout_ms(profile):
+    """Longest a send can take with profile's retries, plus some margin."""
+    speed, power, delay_us, count = PROFILES[profile]
+    return (delay_us + 600) * (count + 1) // 1000 + 5
+
+
+class LinkTuner:
+    """
+    Moves along PROFILES from the retransmit count (OBSERVE_TX.ARC_CNT) of
+    every ACKed send. After each window of sends it steps one profile more
+    robust if any send failed or there was more than one retry per send on
+    average, and one profile faster after clean_windows windows in a row
+    with at most one retry per four sends. wanted is the profile to use;
+    the counters and last_retries_x100 make up the link statistics.
+    """
+
+    def __init__(self, profile=DEFAULT_PROFILE, window=16, clean_windows=3):
+        self.profile = profile   # in use, set by whoever applies it
+        self.wanted = profile
+        self.window = window
+        self.clean_windows = clean_windows
+        self.windows = 0
+        self.step_ups = 0
+        self.step_downs = 0
+        self.last_retries_x100 = 0  # average retries per send in the last window
+        self._sends = 0
+        self._retries = 0
+        self._fails = 0
+        self._clean = 0
+
+    def reset(self, profile=DEFAULT_PROFILE):
+        self.profile = self.wanted = profile
+        self._sends = self._retries = self._fails = self._clean = 0
+
+    def record(self, ok, retries):
+        self._sends += 1
+        self._retries += retries
+        if not ok:
+            self._fails += 1
+        if self._sends >= self.window:
+            self._decide()
+
+    def _decide(self):
+        sends = self._sends
+        retries = self._retries
+        self.windows += 1
+        self.last_retries_x100 = retries * 100 // sends
+        if self._fails or retries > sends:
+            self._clean = 0
+            if self.wanted > 0:
+                self.wanted -= 1
+                self.step_downs += 1
+        elif retries * 4 <= sends:
+            self._clean += 1
+            if self._clean >= self.clean_windows and self.wanted < len(PROFILES) - 1:
+                self._clean = 0
+                self.wanted += 1
+                self.step_ups += 1
+        else:
+            self._clean = 0
+        self._sends = self._retries = self._fails = 0
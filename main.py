@@ -1,10 +1,20 @@
 # main.py
 from machine import I2C, Pin, UART, SPI
-from time import sleep
-from PiicoDev_VL53L1X import PiicoDev_VL53L1X  # Ensure this library is installed
-from nrfmaster import radio_setup, transmit
-import struct
+from PiicoDev_VL53L1X import PiicoDev_VL53L1X, DISTANCE_MODE_SHORT, DISTANCE_MODE_LONG, WINDOW_BELOW  # Ensure this library is installed
+from tof_health import SensorHealth
+from nrfmaster import radio_setup, TxScheduler, LinkManager
+from protocol import unpack_telemetry, MODE_THRESHOLD_MM
+from aqueue import Queue
+from ringbuf import SampleRing
+from atengine import ATEngine, RESULT_OK
+from modem import ModemSupervisor, STATUS_READY
+from outbox import SmsOutbox
+from gnss import GnssTracker
+from buttons import Buttons, GESTURE_PRESS, GESTURE_HOLD
+from array import array
+import _thread
 import time
+from compat import asyncio
 
 # ---------------------------------------------------------
 # Setup I2C buses for the two ToF sensors (adjust pins as needed)
@@ -17,11 +27,20 @@ right_i2c = I2C(1, sda=Pin(7), scl=Pin(8), freq=400000)
 try:
     left_sensor = PiicoDev_VL53L1X(bus=left_i2c)
     right_sensor = PiicoDev_VL53L1X(bus=right_i2c)
+    # Re-initialise a sensor in the background if it stops answering
+    left_health = SensorHealth(left_sensor)
+    right_health = SensorHealth(right_sensor)
     sensors_available = True
 except Exception as e:
     print("Error initializing ToF sensors:", e)
     sensors_available = False
 
+# GPIO1 interrupt outputs of the ToF sensors (active high). Each sensor is
+# programmed to assert GPIO1 only when an obstacle is inside the mode's threshold,
+# so core 1 sleeps until one of them fires and only then touches I2C.
+left_tof_int  = Pin(14, Pin.IN)
+right_tof_int = Pin(15, Pin.IN)
+
 
 # ---------------------------------------------------------
 # Setup the NRF module (for sending alerts)
@@ -34,40 +53,58 @@ nrf = radio_setup()
 # Initialize UART for the EC200U GSM module (adjust TX/RX pins as needed)
 gsm_uart = UART(0, baudrate=115200, tx=Pin(0), rx=Pin(1))
 PHONE_NUMBER = "+919367952877"  # Replace with your recipient number
+# Every SOS goes to each of these; add more numbers as needed
+EMERGENCY_CONTACTS = [PHONE_NUMBER]
 MESSAGE = "ALERT: Emergency situation detected!"
+SMS_TIMEOUT_MS = 60000  # The network can take this long to accept a message
 
-def send_at_command(command, delay=1):
-    """Send an AT command to the GSM module and return its response."""
-    gsm_uart.write(command.encode() + b'\r\n')
-    time.sleep(delay)
-    response = gsm_uart.read()
-    return response if response else b""
-
-def send_sms():
-    """Send an SOS SMS using AT commands."""
-    print("Setting SMS to text mode...")
-    response = send_at_command("AT+CMGF=1")
-    print("Response:", response)
-
-    print("Setting recipient number:", PHONE_NUMBER)
-    response = send_at_command(f'AT+CMGS="{PHONE_NUMBER}"', 2)
-    print("Response:", response)
-
-    if b'>' not in response:
-        print("Error: No '>' prompt received. SMS not sent.")
-        return False
-
-    print("Sending message...")
-    gsm_uart.write(MESSAGE.encode() + b"\x1A")  # CTRL+Z to send
-    time.sleep(5)
-    response = gsm_uart.read()
-    print("Final response:", response)
-    if response and b"+CMGS:" in response:
-        print("SMS sent successfully!")
-        return True
+# Commands finish on the modem's final result code instead of fixed sleeps;
+# unsolicited result codes are routed to the handlers below.
+at = ATEngine(gsm_uart)
+
+def on_new_sms(line):
+    print("SMS received:", line)
+
+def on_ring(line):
+    print("Incoming call")
+
+at.on(b"+CMTI:", on_new_sms)
+at.on(b"RING", on_ring)
+
+def on_modem_status(status):
+    # Reported as soon as it changes, not when someone presses SOS
+    if status == STATUS_READY:
+        print("GSM ready for SOS")
     else:
-        print("Failed to send SMS.")
-        return False
+        print("WARNING: GSM not ready for SOS:", status)
+
+# Text mode is set once at boot; registration and signal are tracked in the background
+modem = ModemSupervisor(at, on_change=on_modem_status)
+# Last GNSS fix, refreshed in the background so an SOS never waits for one
+gnss = GnssTracker(at)
+
+async def send_sms(number, message=MESSAGE):
+    """Send one SMS using AT commands; returns True once the network accepted it."""
+    if not modem.ready:
+        print("GSM not ready ({}), checking again...".format(modem.status))
+        if not await modem.check():
+            print("SMS not sent: GSM", modem.status)
+            return False
+
+    print("Sending message to", number)
+    # Cached fix only: a retry picks up whatever newer fix arrived meanwhile
+    text = "{}\n{}".format(message, gnss.describe())
+    # The text goes out at the '>' prompt, terminated by CTRL+Z
+    result, lines = await at.command('AT+CMGS="{}"'.format(number), SMS_TIMEOUT_MS,
+                                     text.encode() + b"\x1A")
+    if result == RESULT_OK:
+        print("SMS sent successfully!", lines)
+        return True
+    print("Failed to send SMS:", result, lines)
+    return False
+
+# Unsent SOS messages are kept in flash and retried with backoff until delivered
+outbox = SmsOutbox(send_sms)
     
 # ==================================================
 # Button Setup
@@ -78,99 +115,272 @@ sos_button   = Pin(9,  Pin.IN, Pin.PULL_UP)  # SOS button
 power_button = Pin(22,  Pin.IN, Pin.PULL_UP)  # Power button
 mode_button  = Pin(13,  Pin.IN, Pin.PULL_UP)  # Mode button
 
-# Global variables for button handling
-sos_press_count = 0
-sos_last_press_time = 0  # in milliseconds
+SOS_PRESSES = 3     # presses in a row that send an SOS
+POWER_HOLD_MS = 3000
 
 # Mode settings:
 #   Mode 0: Normal (ToF threshold = 2000 mm)
 #   Mode 1: Crowd  (ToF threshold = 2500 mm)
 #   Mode 2: Train  (Alerts disabled; threshold set extremely high)
 mode = 0
-tof_threshold = 2000  # Default threshold (in mm)
+tof_threshold = MODE_THRESHOLD_MM[mode]  # Default threshold (in mm); the slaves scale alarms to it
+
+# Ranging per mode: (distance mode, timing budget ms, inter-measurement period ms)
+#   NORMAL: long range with a longer budget for stable readings out to the threshold
+#   CROWD:  short range with a 20 ms budget so close obstacles are reported quickly
+# The inter-measurement period equals the budget so each sensor ranges back to back.
+MODE_RANGING = {
+    0: (DISTANCE_MODE_LONG, 50, 50),
+    1: (DISTANCE_MODE_SHORT, 20, 20),
+}
+
+def configure_ranging():
+    """
+    Apply the current mode's distance mode, timing and threshold to both ToF sensors.
+    Once acquisition has started this must only run on core 1; use request_reconfigure().
+    """
+    if not sensors_available:
+        return
+    distance_mode, budget, period = MODE_RANGING[mode]
+    for sensor in (left_sensor, right_sensor):
+        try:
+            sensor.stop_ranging()
+            sensor.set_distance_mode(distance_mode)
+            sensor.set_timing_budget(budget)
+            sensor.set_inter_measurement(period)
+            sensor.set_distance_threshold(tof_threshold, tof_threshold, WINDOW_BELOW)
+            sensor.clear_interrupt()
+            sensor.start_ranging()
+        except OSError:
+            # Its health monitor restores the new settings once it recovers
+            print("Could not configure ToF sensor 0x{:02X}".format(sensor.addr))
 
 def update_mode():
     """Cycle through modes and update the ToF detection threshold accordingly."""
     global mode, tof_threshold
     mode = (mode + 1) % 2  # Cycle through 0, 1
+    tof_threshold = MODE_THRESHOLD_MM[mode]
     if mode == 0:
-        tof_threshold = 2000
         print("Mode: NORMAL. ToF threshold =", tof_threshold, "mm")
     elif mode == 1:
-        tof_threshold = 800
         print("Mode: CROWD. ToF threshold =", tof_threshold, "mm")
+    request_reconfigure()
+
+# ==================================================
+# Core 1: sensor acquisition
+# ==================================================
+# Core 1 reads and filters both sensors and pushes samples into a lock-free
+# ring; core 0 runs the asyncio tasks (radio, GSM, buttons) and drains it.
+LEFT = 0
+RIGHT = 1
+SIDES = ("left", "right")
+
+samples = SampleRing(64)
+
+# Flags shared between the cores; single-byte stores need no lock
+acq_control = bytearray(5)
+ACQ_STOP = 0
+ACQ_RECONFIGURE = 1
+ACQ_RUNNING = 2
+ACQ_PENDING = 3  # ACQ_PENDING + side: set by that sensor's GPIO1 IRQ
+
+# Longest core 1 sleeps with no obstacle before stepping the health monitors
+ACQ_IDLE_MS = 50
+
+def left_tof_irq(pin):
+    acq_control[ACQ_PENDING + LEFT] = 1
+
+def right_tof_irq(pin):
+    acq_control[ACQ_PENDING + RIGHT] = 1
+
+left_tof_int.irq(trigger=Pin.IRQ_RISING, handler=left_tof_irq)
+right_tof_int.irq(trigger=Pin.IRQ_RISING, handler=right_tof_irq)
+
+# Median-of-3 spike filter: last two raw readings and the time of the last one per side
+FILTER_STALE_MS = 200  # Older history is replaced by the new sample so old obstacles cannot mask a spike
+filter_history = array('H', [0xFFFF] * 4)
+filter_last_ms = array('i', [0, 0])
 
-def check_buttons():
+def request_reconfigure():
+    """Apply the current mode's ranging settings from whichever core owns the sensors."""
+    if acq_control[ACQ_RUNNING]:
+        acq_control[ACQ_RECONFIGURE] = 1
+    else:
+        configure_ranging()
+
+def filter_sample(side, distance, now):
+    i = side * 2
+    if filter_history[i] == 0xFFFF or time.ticks_diff(now, filter_last_ms[side]) > FILTER_STALE_MS:
+        # No recent history: seed it with this sample and pass it straight
+        # through, so a new obstacle is reported on its first reading
+        filter_history[i] = distance
+        filter_history[i + 1] = distance
+        filter_last_ms[side] = now
+        return distance
+    a = filter_history[i]
+    b = filter_history[i + 1]
+    filter_history[i] = b
+    filter_history[i + 1] = distance
+    filter_last_ms[side] = now
+    # median of a, b, distance
+    if a > b:
+        a, b = b, a
+    if distance < a:
+        return a
+    if distance > b:
+        return b
+    return distance
+
+def wait_for_obstacle(ms):
+    """Sleep in 1 ms steps until a GPIO1 IRQ or a control flag is set, or ms have passed."""
+    for _ in range(ms):
+        if (acq_control[ACQ_PENDING + LEFT] or acq_control[ACQ_PENDING + RIGHT]
+                or acq_control[ACQ_STOP] or acq_control[ACQ_RECONFIGURE]):
+            return
+        time.sleep_ms(1)
+
+def acquisition_loop():
+    """Runs on core 1 until ACQ_STOP is set; owns both sensors and their I2C buses."""
+    monitors = (left_health, right_health)
+    tof_ints = (left_tof_int, right_tof_int)
+    try:
+        while not acq_control[ACQ_STOP]:
+            if acq_control[ACQ_RECONFIGURE]:
+                acq_control[ACQ_RECONFIGURE] = 0
+                configure_ranging()
+            busy = False
+            for side in (LEFT, RIGHT):
+                health = monitors[side]
+                health.poll()  # probe quiet sensors and step any recovery
+                # GPIO1 stays high until the sample is read, so the level also
+                # covers a rising edge that came while the IRQ flag was being cleared
+                if not (acq_control[ACQ_PENDING + side] or tof_ints[side].value()):
+                    continue
+                acq_control[ACQ_PENDING + side] = 0
+                distance = health.read_if_ready()
+                if distance is not None:
+                    samples.push(side, filter_sample(side, distance, time.ticks_ms()))
+                    busy = True
+            if not busy:
+                wait_for_obstacle(ACQ_IDLE_MS)
+    finally:
+        for sensor in (left_sensor, right_sensor):
+            try:
+                sensor.stop_ranging()
+            except OSError:
+                pass
+        acq_control[ACQ_RUNNING] = 0
+
+# ==================================================
+# Tasks
+# ==================================================
+# core 1 -> samples ring -> decide -> TX scheduler
+# buttons -> sms_requests -> gsm
+# Each stage runs on its own, so an SMS or a radio retry never stalls sampling.
+
+def on_tx_complete(target, ok):
+    if ok:
+        print("Alert delivered to {} slave".format(target))
+    else:
+        print("Transmission failed for {} slave".format(target))
+
+# side -> (battery mV or 0 if not measured, seconds since last alarm, error count), from ACK payloads
+slave_telemetry = {}
+
+def on_tx_ack(target, buf, n):
+    telemetry = unpack_telemetry(buf, n)
+    if telemetry is not None:
+        slave_telemetry[target] = telemetry
+
+async def decide_task(tx):
+    """Turn samples inside the current mode's threshold into alerts for that side's slave."""
+    while True:
+        sample = samples.pop()
+        if sample < 0:
+            await asyncio.sleep_ms(5)
+            continue
+        side = SIDES[sample >> 16]
+        distance = sample & 0xFFFF
+        print("{} sensor: {} mm".format(side, distance))
+        if distance <= tof_threshold:
+            print("Obstacle detected on {} side!".format(side.upper()))
+            tx.submit(side, distance, mode)  # Repeats within the coalescing window are merged
+
+async def button_task(sms_requests, shutdown):
     """
-    Check the states of the SOS, Power, and Mode buttons.
-    - SOS: Count presses; if 3 valid presses are detected, trigger an SMS.
-    - Power: If held for 3 seconds, signal a shutdown.
-    - Mode: On each press, cycle the detection mode.
-    Returns "shutdown" if the power button is held long enough.
+    Pin IRQs record the button edges; this task only decodes them, so a held
+    button never blocks anything.
+    - SOS: SOS_PRESSES presses in a row request an SMS.
+    - Power: held for POWER_HOLD_MS, signals a shutdown.
+    - Mode: each press cycles the detection mode.
     """
-    global sos_press_count, sos_last_press_time
-    current_time = time.ticks_ms()
-
-    # --- SOS Button ---
-    if sos_button.value() == 0:  # Button pressed (active low)
-        time.sleep_ms(50)  # Simple debounce
-        if sos_button.value() == 0:
-            # Only count if sufficient time has passed since the last press
-            if time.ticks_diff(current_time, sos_last_press_time) > 500:
-                sos_press_count += 1
-                sos_last_press_time = current_time
-                print("SOS button pressed. Count =", sos_press_count)
-            # Wait until the button is released to avoid multiple counts
-            while sos_button.value() == 0:
-                time.sleep_ms(10)
-    if sos_press_count >= 3:
-        print("SOS triggered! Sending SMS...")
-        send_sms()
-        sos_press_count = 0  # Reset the counter after triggering
-
-    # --- Power Button ---
-    if power_button.value() == 0:
-        press_start = time.ticks_ms()
-        while power_button.value() == 0:
-            time.sleep_ms(10)
-            if time.ticks_diff(time.ticks_ms(), press_start) > 3000:
-                print("Power button held for 3 seconds. Shutting down...")
-                return "shutdown"
-            sleep(0.1) #Reduce CPU usage while checking
-
-    # --- Mode Button ---
-    if mode_button.value() == 0:
-        time.sleep_ms(50)  # Debounce
-        if mode_button.value() == 0:
+    def on_gesture(name, gesture, count):
+        if name == "sos" and gesture == GESTURE_PRESS:
+            print("SOS button pressed {} time(s)".format(count))
+            if count >= SOS_PRESSES:
+                print("SOS triggered! Sending SMS...")
+                sms_requests.put_nowait(MESSAGE)
+        elif name == "power" and gesture == GESTURE_HOLD:
+            print("Power button held for 3 seconds. Shutting down...")
+            shutdown.set()
+        elif name == "mode" and gesture == GESTURE_PRESS:
             update_mode()
-            while mode_button.value() == 0:
-                time.sleep_ms(10)
-    return None
+
+    buttons = Buttons(on_gesture)
+    buttons.add(sos_button, "sos")
+    buttons.add(power_button, "power", hold_ms=POWER_HOLD_MS)
+    buttons.add(mode_button, "mode", gap_ms=0)  # act on every press straight away
+    while not shutdown.is_set():
+        buttons.poll()
+        await asyncio.sleep_ms(20)
+
+async def gsm_task(sms_requests):
+    while True:
+        message = await sms_requests.get()
+        outbox.add(message, EMERGENCY_CONTACTS)
+
+async def stop_acquisition(timeout=1000):
+    """Ask core 1 to stop and wait for it to release the sensors."""
+    acq_control[ACQ_STOP] = 1
+    start = time.ticks_ms()
+    while acq_control[ACQ_RUNNING] and time.ticks_diff(time.ticks_ms(), start) < timeout:
+        await asyncio.sleep_ms(10)
+    print("Acquisition stopped. Samples dropped:", samples.dropped)
+
+async def run():
+    tx = TxScheduler(nrf, on_complete=on_tx_complete, on_ack=on_tx_ack)
+    link = LinkManager(nrf, tx)  # channel survey, keepalive and fallback
+    sms_requests = Queue(2)
+    shutdown = asyncio.Event()
+
+    tasks = [
+        asyncio.create_task(decide_task(tx)),
+        asyncio.create_task(tx.run()),
+        asyncio.create_task(link.run()),
+        asyncio.create_task(button_task(sms_requests, shutdown)),
+        asyncio.create_task(gsm_task(sms_requests)),
+        asyncio.create_task(outbox.run()),
+        asyncio.create_task(at.run()),
+        asyncio.create_task(modem.run()),
+        asyncio.create_task(gnss.run()),
+    ]
+
+    await shutdown.wait()
+    if sensors_available:
+        await stop_acquisition()
+    for task in tasks:
+        task.cancel()
 
 def main():
     print("System started.")
     print("Press the SOS button 3 times to send an emergency SMS.")
     print("Hold the POWER button for 3 seconds to shut down the system.")
     print("Press the MODE button to cycle through detection modes.")
-    
-
-    while True:
-        # Read distances (in mm) from both ToF sensors
-        left_distance = left_sensor.read()
-        right_distance = right_sensor.read()
-        print("Left sensor: {} mm, Right sensor: {} mm".format(left_distance, right_distance))
-        
-        # If an obstacle is detected on the left side, send an alert to left slave
-        if left_distance <= tof_threshold:
-            print("Obstacle detected on LEFT side!")
-            transmit(nrf, "left")
-        
-        # If an obstacle is detected on the right side, send an alert to right slave
-        if right_distance <= tof_threshold:
-            print("Obstacle detected on RIGHT side!")
-            transmit(nrf, "right")
-        
-        sleep(0.1)  # Short delay before the next sensor reading
+    configure_ranging()
+    if sensors_available:
+        acq_control[ACQ_RUNNING] = 1  # Set before the thread starts so mode changes go through core 1
+        _thread.start_new_thread(acquisition_loop, ())
+    asyncio.run(run())
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,114 @@
+# modem.py
+# Background supervisor for the EC200U: configures it once and keeps a
+# cached view of whether an SMS could go out right now.
+from atengine import RESULT_OK
+from compat import asyncio, ticks_ms
+
+# status values, worst first
+STATUS_NO_MODEM = "no modem"
+STATUS_NOT_REGISTERED = "not registered"
+STATUS_NO_SIGNAL = "no signal"
+STATUS_READY = "ready"
+
+# Commands sent once per modem power-up
+_SETUP = (
+    "ATE0",         # no echo
+    "AT+CMGF=1",    # SMS text mode
+    "AT+CREG=1",    # report registration changes as +CREG: <stat> URCs
+)
+
+
+def _fields(line):
+    """b'+CSQ: 23,99' -> [b'23', b'99']"""
+    return line[line.find(b":") + 1:].strip().split(b",")
+
+
+class ModemSupervisor:
+    """
+    Sets the modem up at boot and re-checks registration (AT+CREG?) and
+    signal (AT+CSQ) every interval_ms, or every retry_ms while not ready.
+    ready and status are cached, so the SOS path can go straight to
+    AT+CMGS. +CREG URCs update the cache between checks, and
+    on_change(status) is called whenever status changes.
+    """
+
+    def __init__(self, at, interval_ms=30000, retry_ms=5000, on_change=None):
+        self.at = at
+        self.interval_ms = interval_ms
+        self.retry_ms = retry_ms
+        self.on_change = on_change
+        self.configured = False
+        self.registered = False
+        self.rssi = 99          # AT+CSQ scale: 0-31, 99 = unknown
+        self.status = STATUS_NO_MODEM
+        self.checked_ms = None  # ticks_ms of the last completed check
+        self._wake = asyncio.Event()
+        at.on(b"+CREG:", self._on_creg)
+
+    @property
+    def ready(self):
+        return self.status == STATUS_READY
+
+    def _set_status(self, status):
+        if status != self.status:
+            self.status = status
+            if self.on_change is not None:
+                self.on_change(status)
+
+    def _update(self):
+        if not self.configured:
+            self._set_status(STATUS_NO_MODEM)
+        elif not self.registered:
+            self._set_status(STATUS_NOT_REGISTERED)
+        elif self.rssi == 99:
+            self._set_status(STATUS_NO_SIGNAL)
+        else:
+            self._set_status(STATUS_READY)
+
+    def _on_creg(self, line):
+        # URC form: +CREG: <stat>[,<lac>,<ci>]; 1 = home, 5 = roaming
+        self.registered = _fields(line)[0] in (b"1", b"5")
+        self._update()
+        if not self.registered:
+            self._wake.set()  # re-check soon instead of waiting out the interval
+
+    async def configure(self):
+        for cmd in _SETUP:
+            result, lines = await self.at.command(cmd)
+            if result != RESULT_OK:
+                self.configured = False
+                return False
+        self.configured = True
+        return True
+
+    async def check(self):
+        """Refresh the cached state now; returns ready."""
+        if not self.configured:
+            await self.configure()
+        if self.configured:
+            result, lines = await self.at.command("AT+CREG?")
+            if result == RESULT_OK and lines:
+                # response form: +CREG: <n>,<stat>[,...]
+                fields = _fields(lines[0])
+                self.registered = len(fields) > 1 and fields[1] in (b"1", b"5")
+            elif result != RESULT_OK:
+                self.configured = False  # modem gone or reset; set it up again
+            result, lines = await self.at.command("AT+CSQ")
+            if result == RESULT_OK and lines:
+                self.rssi = int(_fields(lines[0])[0])
+        self.checked_ms = ticks_ms()
+        self._update()
+        return self.ready
+
+    def request_check(self):
+        self._wake.set()
+
+    async def run(self):
+        while True:
+            await self.check()
+            self._wake.clear()
+            wait = self.interval_ms if self.ready else self.retry_ms
+            try:
+                await asyncio.wait_for(self._wake.wait(), wait / 1000)
+            except asyncio.TimeoutError:
+                pass
@@ -16,13 +16,19 @@ SETUP_RETR = const(0x04)
 RF_CH = const(0x05)
 RF_SETUP = const(0x06)
 STATUS = const(0x07)
+OBSERVE_TX = const(0x08)
+RPD = const(0x09)
 RX_ADDR_P0 = const(0x0A)
 TX_ADDR = const(0x10)
 RX_PW_P0 = const(0x11)
 FIFO_STATUS = const(0x17)
 DYNPD = const(0x1C)
+FEATURE = const(0x1D)
 
 # CONFIG register
+MASK_RX_DR = const(0x40)  # 1=RX_DR does not drive the IRQ pin
+MASK_TX_DS = const(0x20)  # 1=TX_DS does not drive the IRQ pin
+MASK_MAX_RT = const(0x10)  # 1=MAX_RT does not drive the IRQ pin
 EN_CRC = const(0x08)  # enable CRC
 CRCO = const(0x04)  # CRC encoding scheme; 0=1 byte, 1=2 bytes
 PWR_UP = const(0x02)  # 1=power up, 0=power down
@@ -45,20 +51,40 @@ MAX_RT = const(0x10)  # max retransmits reached; write 1 to clear
 # FIFO_STATUS register
 RX_EMPTY = const(0x01)  # 1 if RX FIFO is empty
 
+# FEATURE register
+EN_DPL = const(0x04)  # enable dynamic payload length
+EN_ACK_PAY = const(0x02)  # enable payload with ACK
+EN_DYN_ACK = const(0x01)  # enable W_TX_PAYLOAD_NOACK
+
+# registers the shadow cache may serve: CONFIG..RF_SETUP, RX_ADDR_P2..P5,
+# RX_PW_P0..P5, DYNPD and FEATURE. STATUS, OBSERVE_TX, RPD and FIFO_STATUS
+# change under the chip's control and are always read over SPI.
+_SHADOW_REGS = const(0x307EF07F)
+
 # constants for instructions
 R_RX_PL_WID = const(0x60)  # read RX payload width
 R_RX_PAYLOAD = const(0x61)  # read RX payload
 W_TX_PAYLOAD = const(0xA0)  # write TX payload
+W_ACK_PAYLOAD = const(0xA8)  # write ACK payload; OR with the pipe number
+W_TX_PAYLOAD_NOACK = const(0xB0)  # write TX payload, receiver must not ACK
 FLUSH_TX = const(0xE1)  # flush TX FIFO
 FLUSH_RX = const(0xE2)  # flush RX FIFO
 NOP = const(0xFF)  # use to read STATUS register
 
 
 class NRF24L01:
-    def __init__(self, spi, cs, ce, channel=46, payload_size=16):
+    # shadow=True keeps a local copy of the configuration registers so that
+    # read-modify-write sequences only read STATUS/FIFO_STATUS over SPI
+    def __init__(self, spi, cs, ce, channel=46, payload_size=16, shadow=False):
         assert payload_size <= 32
 
         self.buf = bytearray(1)
+        # command/response pair for single-transaction register access
+        self._cmd = bytearray(2)
+        self._resp = bytearray(2)
+        # zero padding for short payloads, one view per pad length
+        zeros = memoryview(bytearray(payload_size))
+        self._pad = [zeros[:n] for n in range(payload_size + 1)]
 
         # store the pins
         self.spi = spi
@@ -74,6 +100,11 @@ class NRF24L01:
 
         self.payload_size = payload_size
         self.pipe0_read_addr = None
+        self.dynamic_payloads = False
+        self._view_src = None
+        self._views = None
+        self._shadow = None
+        self._valid = 0
         utime.sleep_ms(5)
 
         # set address width to 5 bytes and check for device present
@@ -81,7 +112,12 @@ class NRF24L01:
         if self.reg_read(SETUP_AW) != 0b11:
             raise OSError("nRF24L01+ Hardware not responding")
 
-        # disable dynamic payloads
+        # the presence check above must hit the chip, so enable the cache after it
+        if shadow:
+            self._shadow = bytearray(32)
+
+        # disable dynamic payloads and ACK payloads
+        self.reg_write(FEATURE, 0)
         self.reg_write(DYNPD, 0)
 
         # auto retransmit delay: 1750us
@@ -113,11 +149,18 @@ class NRF24L01:
             self.spi.init(master, baudrate=baudrate, polarity=0, phase=0)
 
     def reg_read(self, reg):
+        if (self._valid >> reg) & 1:
+            return self._shadow[reg]
+        self._cmd[0] = reg
+        self._cmd[1] = NOP
         self.cs(0)
-        self.spi.readinto(self.buf, reg)
-        self.spi.readinto(self.buf)
+        self.spi.write_readinto(self._cmd, self._resp)
         self.cs(1)
-        return self.buf[0]
+        value = self._resp[1]
+        if self._shadow is not None and (_SHADOW_REGS >> reg) & 1:
+            self._shadow[reg] = value
+            self._valid |= 1 << reg
+        return value
 
     def reg_write_bytes(self, reg, buf):
         self.cs(0)
@@ -127,13 +170,27 @@ class NRF24L01:
         return self.buf[0]
 
     def reg_write(self, reg, value):
+        self._cmd[0] = 0x20 | reg
+        self._cmd[1] = value
         self.cs(0)
-        self.spi.readinto(self.buf, 0x20 | reg)
-        ret = self.buf[0]
-        self.spi.readinto(self.buf, value)
+        self.spi.write_readinto(self._cmd, self._resp)
         self.cs(1)
+        ret = self._resp[0]
+        if self._shadow is not None and (_SHADOW_REGS >> reg) & 1:
+            self._shadow[reg] = value & 0xFF
+            self._valid |= 1 << reg
         return ret
 
+    # drop the shadow copy so the next reads reload it from the chip,
+    # e.g. after a brown-out or when the radio stops behaving as configured
+    def resync(self):
+        if self._shadow is None:
+            return
+        self._valid = 0
+        for reg in range(32):
+            if (_SHADOW_REGS >> reg) & 1:
+                self.reg_read(reg)
+
     def flush_rx(self):
         self.cs(0)
         self.spi.readinto(self.buf, FLUSH_RX)
@@ -149,6 +206,16 @@ class NRF24L01:
         setup = self.reg_read(RF_SETUP) & 0b11010001
         self.reg_write(RF_SETUP, setup | power | speed)
 
+    # auto retransmit delay in us (250-4000, steps of 250) and count (0-15)
+    def set_retries(self, delay_us, count):
+        ard = min(max(delay_us // 250 - 1, 0), 15)
+        self.reg_write(SETUP_RETR, (ard << 4) | min(count, 15))
+
+    # (PLOS_CNT << 4) | ARC_CNT: packets lost since the last RF_CH write
+    # (stops at 15) and retransmits used by the last packet sent
+    def observe_tx(self):
+        return self.reg_read(OBSERVE_TX)
+
     # length in bytes: 0, 1 or 2
     def set_crc(self, length):
         config = self.reg_read(CONFIG) & ~(CRCO | EN_CRC)
@@ -160,9 +227,25 @@ class NRF24L01:
             config |= EN_CRC | CRCO
         self.reg_write(CONFIG, config)
 
+    # keep the given STATUS flags off the IRQ pin; they are still set in STATUS
+    def mask_irq(self, rx_dr=False, tx_ds=False, max_rt=False):
+        config = self.reg_read(CONFIG) & ~(MASK_RX_DR | MASK_TX_DS | MASK_MAX_RT)
+        if rx_dr:
+            config |= MASK_RX_DR
+        if tx_ds:
+            config |= MASK_TX_DS
+        if max_rt:
+            config |= MASK_MAX_RT
+        self.reg_write(CONFIG, config)
+
     def set_channel(self, channel):
         self.reg_write(RF_CH, min(channel, 125))
 
+    # True if the receiver saw a carrier above -64 dBm on the current channel;
+    # only meaningful after at least 170us in RX mode
+    def rpd(self):
+        return bool(self.reg_read(RPD) & 0x01)
+
     # address should be a bytes object 5 bytes long
     def open_tx_pipe(self, address):
         assert len(address) == 5
@@ -207,19 +290,102 @@ class NRF24L01:
         return not bool(self.reg_read(FIFO_STATUS) & RX_EMPTY)
 
     def recv(self):
-        # get the data
+        buf = bytearray(32 if self.dynamic_payloads else self.payload_size)
+        n = self.recv_into(buf)
+        return buf if n == len(buf) else buf[:n]
+
+    # read the next payload into buf and return its length. With fixed
+    # payloads buf must be payload_size bytes long; with dynamic payloads it
+    # must hold the largest expected payload. Allocates nothing when the same
+    # buffer is reused, so it is safe for tight receive loops
+    def recv_into(self, buf):
+        n = self._read_payload(buf)
+        # clear RX ready flag
+        self.reg_write(STATUS, RX_DR)
+        return n
+
+    # IRQ-driven receive: read every queued payload into buf, calling
+    # handler(buf, length) for each. RX_DR is cleared before the FIFO is
+    # emptied, so a payload landing mid-drain pulls IRQ low again instead of
+    # being missed.
+    def drain_rx(self, buf, handler):
+        self.reg_write(STATUS, RX_DR)
+        count = 0
+        while not (self.reg_read(FIFO_STATUS) & RX_EMPTY):
+            n = self._read_payload(buf)
+            if n:
+                handler(buf, n)
+            count += 1
+        return count
+
+    def _read_payload(self, buf):
+        if self.dynamic_payloads:
+            n = self.payload_width()
+            if not n:
+                return 0
+            target = self._view(buf, min(n, len(buf)))
+        else:
+            n = len(buf)
+            target = buf
         self.cs(0)
         self.spi.readinto(self.buf, R_RX_PAYLOAD)
-        buf = self.spi.read(self.payload_size)
+        self.spi.readinto(target)
         self.cs(1)
-        # clear RX ready flag
-        self.reg_write(STATUS, RX_DR)
+        return min(n, len(buf))
+
+    # views of buf for every length, built once per buffer so that partial
+    # reads do not allocate
+    def _view(self, buf, n):
+        if buf is not self._view_src:
+            mv = memoryview(buf)
+            self._views = [mv[:i] for i in range(len(buf) + 1)]
+            self._view_src = buf
+        return self._views[n]
+
+    # width of the payload at the head of the RX FIFO (dynamic payloads only);
+    # a width over 32 means a corrupt packet, which is flushed and reported as 0
+    def payload_width(self):
+        self._cmd[0] = R_RX_PL_WID
+        self._cmd[1] = NOP
+        self.cs(0)
+        self.spi.write_readinto(self._cmd, self._resp)
+        self.cs(1)
+        n = self._resp[1]
+        if n > 32:
+            self.flush_rx()
+            return 0
+        return n
+
+    # dynamic payload length on every pipe; must match on both ends of a link
+    def set_dynamic_payloads(self, enable=True):
+        feature = self.reg_read(FEATURE)
+        if enable:
+            self.reg_write(FEATURE, feature | EN_DPL)
+            self.reg_write(DYNPD, 0x3F)
+        else:
+            self.reg_write(FEATURE, feature & ~(EN_DPL | EN_ACK_PAY))
+            self.reg_write(DYNPD, 0)
+        self.dynamic_payloads = enable
+
+    # let the receiver attach a payload to its auto-ACK (needs dynamic payloads)
+    def enable_ack_payload(self):
+        self.set_dynamic_payloads(True)
+        self.reg_write(FEATURE, self.reg_read(FEATURE) | EN_ACK_PAY)
+
+    # allow send(..., ack=False); needed on the transmitting side only
+    def enable_dynamic_ack(self):
+        self.reg_write(FEATURE, self.reg_read(FEATURE) | EN_DYN_ACK)
 
-        return buf
+    # queue buf (up to 32 bytes) to go out with the next ACK on pipe_id
+    def write_ack_payload(self, pipe_id, buf):
+        self.cs(0)
+        self.spi.readinto(self.buf, W_ACK_PAYLOAD | pipe_id)
+        self.spi.write(buf)
+        self.cs(1)
 
     # blocking wait for tx complete
-    def send(self, buf, timeout=500):
-        self.send_start(buf)
+    def send(self, buf, timeout=500, ack=True):
+        self.send_start(buf, ack)
         start = utime.ticks_ms()
         result = None
         while result is None and utime.ticks_diff(utime.ticks_ms(), start) < timeout:
@@ -227,17 +393,19 @@ class NRF24L01:
         if result == 2:
             raise OSError("send failed")
 
-    # non-blocking tx
-    def send_start(self, buf):
+    # non-blocking tx. ack=False sends a frame no receiver acknowledges, so
+    # any number of them can listen on the same address; TX_DS is set as
+    # soon as it is on air. Needs enable_dynamic_ack()
+    def send_start(self, buf, ack=True):
         # power up
         self.reg_write(CONFIG, (self.reg_read(CONFIG) | PWR_UP) & ~PRIM_RX)
         utime.sleep_us(150)
         # send the data
         self.cs(0)
-        self.spi.readinto(self.buf, W_TX_PAYLOAD)
+        self.spi.readinto(self.buf, W_TX_PAYLOAD if ack else W_TX_PAYLOAD_NOACK)
         self.spi.write(buf)
-        if len(buf) < self.payload_size:
-            self.spi.write(b"\x00" * (self.payload_size - len(buf)))  # pad out data
+        if len(buf) < self.payload_size and not self.dynamic_payloads:
+            self.spi.write(self._pad[self.payload_size - len(buf)])  # pad out data
         self.cs(1)
 
         # enable the chip so it can send the data
@@ -1,7 +1,12 @@
 from machine import Pin, SPI
-import struct
 from nrf24l01 import NRF24L01
+from protocol import pack_alert, pack_both_alert, ALERT_SIZE, BOTH_ALERT_SIZE, SIDE_LEFT, SIDE_RIGHT, SIDE_BOTH, BROADCAST_PIPE
+from protocol import pack_control, FRAME_ALERT, FRAME_HOP, FRAME_PING, FRAME_RADIO
+from protocol import RENDEZVOUS_CHANNEL, DEFAULT_RF_SETUP, KEEPALIVE_MS
+from rfsurvey import CHANNELS, begin_survey, end_survey, sweep, rank_channels, retune, set_rf
+from linktune import LinkTuner, PROFILES, DEFAULT_PROFILE, send_timeout_ms
 import time
+from compat import asyncio
 
 # Initialize onboard LED for transmission indication
 led = Pin(2, Pin.OUT)
@@ -16,49 +21,518 @@ LEFT_PIPE  = b"\xe1\xf0\xf0\xf0\x01"  # Left slave address
 RIGHT_PIPE = b"\xe1\xf0\xf0\xf0\x02"  # Right slave address
 
 def radio_setup():
-    nrf = NRF24L01(spi, csn, ce, payload_size=4)
+    nrf = NRF24L01(spi, csn, ce, payload_size=4, shadow=True)  # Cache config registers for the TX hot path
+    # Dynamic payloads; the slaves answer with telemetry in the auto-ACK
+    nrf.enable_ack_payload()
+    # No-ACK frames for alerts broadcast to both slaves at once
+    nrf.enable_dynamic_ack()
     nrf.open_tx_pipe(LEFT_PIPE)
     
-    # Set channel to 76
-    nrf.reg_write(0x05, 108)
+    # Start on the rendezvous channel; LinkManager moves everyone to a quieter one
+    nrf.reg_write(0x05, RENDEZVOUS_CHANNEL)
     
     # Set power level to 0 dBm and data rate to 1 Mbps
-    nrf.reg_write(0x06, 0x06)
+    nrf.reg_write(0x06, DEFAULT_RF_SETUP)
     
     # Power up the device
     config = nrf.reg_read(0x00)
     config |= 0x02  # Set PWR_UP bit (bit 1)
     nrf.reg_write(0x00, config)
     
+    # Reload the register cache from the chip so the debug output shows real values
+    nrf.resync()
+
     # Debug registers
     print("CONFIG:", bin(nrf.reg_read(0x00)))  # Should be 0b1110 (0x0E)
     print("RF_SETUP:", bin(nrf.reg_read(0x06)))  # Should be 0b110 (0x06)
     print("Channel:", nrf.reg_read(0x05))  # Should be 76
     return nrf
 
-def transmit(nrf, target):
+def target_pipe(target):
+    """Return (pipe address, side mask) for 'left', 'right' or 'both', or None."""
     if target == 'left':
-        pipe = LEFT_PIPE
-        trigger = 1  # For example, trigger value for left
+        return LEFT_PIPE, SIDE_LEFT
     elif target == 'right':
-        pipe = RIGHT_PIPE
-        trigger = 2  # For example, trigger value for right
-    else:
-        print("Invalid target specified. Use 'left' or 'right'.")
+        return RIGHT_PIPE, SIDE_RIGHT
+    elif target == 'both':
+        return BROADCAST_PIPE, SIDE_BOTH
+    print("Invalid target specified. Use 'left', 'right' or 'both'.")
+    return None
+
+_transmit_frame = bytearray(ALERT_SIZE)
+_transmit_seq = 0
+
+def transmit(nrf, target):
+    selected = target_pipe(target)
+    if selected is None:
         return
+    global _transmit_seq
+    pipe, side = selected
     nrf.open_tx_pipe(pipe)
     
     try:
         led.value(1)  # Indicate transmission start
-        # Pack the trigger value into 4-byte format and send it
-        nrf.send(struct.pack("i", trigger))
-        print("Sent trigger {} to {} slave".format(trigger, target))
+        _transmit_seq = (_transmit_seq + 1) & 0xFF
+        pack_alert(_transmit_frame, _transmit_seq, side, 0, 0)
+        # Both slaves hear a broadcast, so neither may ACK it
+        nrf.send(_transmit_frame, ack=side != SIDE_BOTH)
+        print("Sent alert {} to {} slave".format(_transmit_seq, target))
+        if nrf.dynamic_payloads:
+            nrf.flush_rx()  # drop the telemetry ACK, nobody reads it here
     except OSError:
+        nrf.flush_tx()  # don't let the failed frame go out with the next one
         print("Transmission failed for {} slave".format(target))
     finally:
         led.value(0)  # Turn off LED after transmission
         time.sleep(0.5)  # A short delay before the next transmission
 
+class TxScheduler:
+    """
+    Non-blocking alert transmitter built on send_start()/send_done().
+
+    submit() queues an alert for a target and returns at once. Alerts for a
+    target that already has one queued, in flight, or sent within the last
+    coalesce_ms are merged into that one; a queued alert carries the latest
+    distance and mode. Each target has its own sequence number, which only
+    advances once a frame is acknowledged, so a resend after a lost ACK is
+    recognised as a duplicate by the slave. poll() (or the run() task) moves
+    the radio along; TX_ADDR is only rewritten when the destination changes.
+    With multicast on, alerts queued for both sides go out as a single
+    'both' frame on BROADCAST_PIPE without ACK, so the two slaves react to
+    the same packet; it carries each side's distance, so each slave keeps
+    its own intensity. 'both' can also be submitted directly.
+    Control frames from submit_control() go ahead of queued alerts and are
+    never merged; while held is set no new send is started.
+    on_complete(target, ok) is called from poll() when each alert finishes,
+    on_control(target, kind, arg, ok) when each control frame finishes,
+    and on_ack(target, buf, n) when the slave's ACK carried a payload.
+    """
+
+    def __init__(self, nrf, coalesce_ms=500, timeout=500, on_complete=None, on_ack=None,
+                 multicast=True, on_control=None):
+        self.nrf = nrf
+        self.multicast = multicast
+        self.coalesce_ms = coalesce_ms
+        self.timeout = timeout
+        self.on_complete = on_complete
+        self.on_ack = on_ack
+        self.on_control = on_control
+        self.held = False
+        self.tuner = None       # LinkTuner fed with the retries of every ACKed send
+        self.retries = 0
+        self._ack_buf = bytearray(32)
+        self._control = []      # (target, kind, arg) waiting to be sent
+        self._control_frame = bytearray(ALERT_SIZE)
+        self._inflight_kind = FRAME_ALERT
+        self._inflight_arg = 0
+        # per slave: consecutive failed sends and ticks_ms of the last ACK
+        self.fail_streak = {'left': 0, 'right': 0}
+        self.last_ok = {'left': time.ticks_ms(), 'right': time.ticks_ms()}
+        self._pending = []      # targets waiting to be sent, oldest first
+        self._last_sent = {}    # target -> ticks_ms of its last send_start()
+        self._pipe = None       # address currently in TX_ADDR
+        self._inflight = None
+        self._start = 0
+        self.sent = 0
+        self.failed = 0
+        self.coalesced = 0
+        # one frame buffer per target, packed in place just before each send
+        self._frames = {}
+        self._alerts = {}       # target -> [distance mm, mode, right distance mm ('both' only)]
+        self._seq = {}
+        for target in ('left', 'right', 'both'):
+            pipe, side = target_pipe(target)
+            size = BOTH_ALERT_SIZE if target == 'both' else ALERT_SIZE
+            self._frames[target] = (pipe, side, bytearray(size))
+            self._alerts[target] = [0, 0, 0]
+            # start away from 0 so a master reboot is unlikely to repeat the
+            # number a slave saw last
+            self._seq[target] = time.ticks_ms() & 0xFF
+
+    def submit(self, target, distance=0, mode=0):
+        """Queue an alert; returns False if it was merged into an earlier one."""
+        if target not in self._frames:
+            print("Invalid target specified. Use 'left', 'right' or 'both'.")
+            return False
+        inflight = self._inflight if self._inflight_kind == FRAME_ALERT else None
+        if target != inflight:
+            alert = self._alerts[target]
+            alert[0] = distance
+            alert[1] = mode
+            alert[2] = distance
+        last = self._last_sent.get(target)
+        if (target in self._pending or target == inflight
+                or (last is not None and time.ticks_diff(time.ticks_ms(), last) < self.coalesce_ms)):
+            self.coalesced += 1
+            return False
+        self._pending.append(target)
+        return True
+
+    def submit_control(self, target, kind, arg=0):
+        """Queue a control frame for 'left' or 'right'."""
+        if target not in self.fail_streak:
+            print("Control frames need 'left' or 'right'.")
+            return False
+        self._control.append((target, kind, arg))
+        return True
+
+    def control_pending(self, target):
+        for queued in self._control:
+            if queued[0] == target:
+                return True
+        return self._inflight == target and self._inflight_kind != FRAME_ALERT
+
+    def idle(self):
+        return self._inflight is None
+
+    def busy(self):
+        return self._inflight is not None or bool(self._pending) or bool(self._control)
+
+    def forget_pipe(self):
+        """Call after touching TX_ADDR outside the scheduler."""
+        self._pipe = None
+
+    def poll(self):
+        """Advance the transmitter without blocking."""
+        nrf = self.nrf
+        if self._inflight is not None:
+            result = nrf.send_done()  # 1 == success, 2 == fail
+            if result is None:
+                if time.ticks_diff(time.ticks_ms(), self._start) < self.timeout:
+                    return
+                result = 2
+            if result == 2:
+                # a failed payload stays in the TX FIFO and would go out ahead
+                # of the next one, possibly to another pipe
+                nrf.flush_tx()
+            self._finish(result == 1)
+
+        if self._inflight is not None or self.held:
+            return
+        if self._control:
+            target, kind, arg = self._control.pop(0)
+            pipe, side, _ = self._frames[target]
+            frame = self._control_frame
+            pack_control(frame, kind, self._seq[target], side, arg)
+            self._send(target, pipe, frame, True, kind, arg)
+        elif self._pending:
+            target = self._pending.pop(0)
+            if self.multicast and target != 'both':
+                other = 'right' if target == 'left' else 'left'
+                if other in self._pending:
+                    # both sides are waiting: one broadcast reaches them together
+                    self._pending.remove(other)
+                    both = self._alerts['both']
+                    both[0] = self._alerts['left'][0]
+                    both[1] = self._alerts[target][1]
+                    both[2] = self._alerts['right'][0]
+                    target = 'both'
+            pipe, side, frame = self._frames[target]
+            distance, mode, right = self._alerts[target]
+            if target == 'both':
+                pack_both_alert(frame, self._seq[target], distance, right, mode)
+            else:
+                pack_alert(frame, self._seq[target], side, distance, mode)
+            self._send(target, pipe, frame, side != SIDE_BOTH, FRAME_ALERT, 0)
+            self._last_sent[target] = self._start
+            if target == 'both':
+                self._last_sent['left'] = self._last_sent['right'] = self._start
+
+    def _send(self, target, pipe, frame, ack, kind, arg):
+        nrf = self.nrf
+        if pipe != self._pipe:
+            nrf.open_tx_pipe(pipe)
+            self._pipe = pipe
+        led.value(1)  # Indicate transmission start
+        nrf.send_start(frame, ack)
+        self._inflight = target
+        self._inflight_kind = kind
+        self._inflight_arg = arg
+        self._start = time.ticks_ms()
+
+    def _finish(self, ok):
+        target = self._inflight
+        kind = self._inflight_kind
+        self._inflight = None
+        led.value(0)  # Turn off LED after transmission
+        if target in self.fail_streak:
+            # ACKed sends only: a broadcast never retries
+            retries = self.nrf.observe_tx() & 0x0F
+            self.retries += retries
+            if self.tuner is not None:
+                self.tuner.record(ok, retries)
+            if ok:
+                self.fail_streak[target] = 0
+                self.last_ok[target] = time.ticks_ms()
+            else:
+                self.fail_streak[target] += 1
+        if ok:
+            self.sent += 1
+            self._seq[target] = (self._seq[target] + 1) & 0xFF
+            # an ACK payload lands in the RX FIFO together with TX_DS
+            nrf = self.nrf
+            while nrf.dynamic_payloads and nrf.any():
+                n = nrf.recv_into(self._ack_buf)
+                if n and self.on_ack is not None:
+                    self.on_ack(target, self._ack_buf, n)
+        else:
+            self.failed += 1
+            if kind == FRAME_ALERT:
+                # let the next alert for this side retry straight away
+                self._last_sent.pop(target, None)
+                if target == 'both':
+                    self._last_sent.pop('left', None)
+                    self._last_sent.pop('right', None)
+        if kind != FRAME_ALERT:
+            if self.on_control is not None:
+                self.on_control(target, kind, self._inflight_arg, ok)
+        elif self.on_complete is not None:
+            self.on_complete(target, ok)
+
+    async def run(self, interval_ms=1):
+        while True:
+            self.poll()
+            await asyncio.sleep_ms(interval_ms if self.busy() else 5)
+
+class LinkManager:
+    """
+    Keeps the master and both slaves on a quiet channel with radio settings
+    that suit the link.
+
+    survey_and_hop() sweeps all 126 channels with RPD while the scheduler is
+    held, then sends each slave a HOP frame for the quietest one and retunes
+    the master only once both have ACKed it; a slave that did move while the
+    other missed the frame is sent back, so one unreachable slave never
+    takes the other off the link. run() does this at start-up, pings
+    any slave not heard from for KEEPALIVE_MS so the slaves can tell a lost
+    link from a quiet street, and drops back to RENDEZVOUS_CHANNEL and the
+    default profile once a slave misses lost_after sends in a row, taking
+    the other slave along. Slaves fall back there on their own too, and the
+    survey is repeated resurvey_ms later, once both slaves answer again.
+    run() prints the link statistics (report()) after each fallback and
+    profile change, and every report_ms otherwise. It also applies the
+    tuner's profile changes; speed and power changes are announced to the
+    slaves with a RADIO frame first, retry delay and count only concern the
+    master.
+    """
+
+    def __init__(self, nrf, tx, sweeps=16, lost_after=3, resurvey_ms=60000, tuner=None, report_ms=60000):
+        self.nrf = nrf
+        self.tx = tx
+        self.sweeps = sweeps
+        self.lost_after = lost_after
+        self.resurvey_ms = resurvey_ms
+        self.report_ms = report_ms
+        self._reported_at = time.ticks_ms()
+        self.channel = nrf.reg_read(0x05)
+        self.counts = None
+        self.tuner = tuner if tuner is not None else LinkTuner()
+        tx.tuner = self.tuner
+        self._results = {}
+        self._last_ping = {'left': 0, 'right': 0}
+        self._fallback_at = None
+        self._apply_profile(self.tuner.profile)
+        tx.on_control = self._on_control
+
+    def _on_control(self, target, kind, arg, ok):
+        if kind != FRAME_PING:
+            self._results[target] = ok
+
+    async def _hold(self):
+        self.tx.held = True
+        while not self.tx.idle():
+            await asyncio.sleep_ms(1)
+
+    def _release(self):
+        self.tx.forget_pipe()
+        self.tx.held = False
+
+    def _apply_profile(self, profile):
+        speed, power, delay_us, count = PROFILES[profile]
+        set_rf(self.nrf, speed | power)
+        self.nrf.set_retries(delay_us, count)
+        self.tx.timeout = send_timeout_ms(profile)
+        self.tuner.profile = profile
+
+    async def _send_control(self, targets, kind, arg, timeout_ms):
+        """Send a control frame to each of targets; returns the ones that ACKed."""
+        self._results.clear()
+        for target in targets:
+            self.tx.submit_control(target, kind, arg)
+        start = time.ticks_ms()
+        while len(self._results) < len(targets) and time.ticks_diff(time.ticks_ms(), start) < timeout_ms:
+            await asyncio.sleep_ms(5)
+        return [target for target in targets if self._results.get(target, False)]
+
+    async def _switch(self, apply):
+        await self._hold()
+        apply()
+        self._release()
+
+    async def _coordinate(self, kind, arg, apply, undo_arg, undo, timeout_ms=2000):
+        """
+        Send a control frame to both slaves and apply() on the master once
+        both have ACKed it. Otherwise the master stays put and the slaves that
+        did switch are sent undo_arg from the new settings, then undo()
+        brings the master back; a slave that did not ACK keeps working.
+        Returns True if the switch went ahead.
+        """
+        acked = await self._send_control(('left', 'right'), kind, arg, timeout_ms)
+        if len(acked) == 2:
+            await self._switch(apply)
+            return True
+        if acked:
+            await self._switch(apply)
+            await self._send_control(acked, kind, undo_arg, timeout_ms)
+            await self._switch(undo)
+        # A slave whose ACK was lost after it switched misses its pings and
+        # both ends end up back on the rendezvous settings
+        return False
+
+    async def survey(self):
+        """Sweep the band between sends; returns per-channel RPD hit counts."""
+        await self._hold()
+        counts = bytearray(CHANNELS)
+        saved = begin_survey(self.nrf)
+        try:
+            for _ in range(self.sweeps):
+                sweep(self.nrf, counts)
+                await asyncio.sleep_ms(0)  # ~30 ms per sweep; let other tasks run
+        finally:
+            end_survey(self.nrf, saved)
+            self._release()
+        self.counts = counts
+        return counts
+
+    async def hop(self, channel):
+        """Move both slaves, then the master, to channel. False if a slave did not ACK."""
+        old = self.channel
+
+        def apply():
+            retune(self.nrf, channel)
+            self.channel = channel
+
+        def undo():
+            retune(self.nrf, old)
+            self.channel = old
+
+        ok = await self._coordinate(FRAME_HOP, channel, apply, old, undo)
+        if ok:
+            print("Hopped to channel", channel)
+        else:
+            print("Not hopping to channel {}: not confirmed by both slaves".format(channel))
+        return ok
+
+    async def set_profile(self, profile):
+        """Switch to one of linktune.PROFILES, telling the slaves if speed or power change."""
+        speed, power = PROFILES[profile][:2]
+        old = self.tuner.profile
+        old_speed, old_power = PROFILES[old][:2]
+        if (speed, power) == (old_speed, old_power):
+            await self._switch(lambda: self._apply_profile(profile))
+            ok = True
+        else:
+            ok = await self._coordinate(FRAME_RADIO, speed | power, lambda: self._apply_profile(profile),
+                                        old_speed | old_power, lambda: self._apply_profile(old))
+        if not ok:
+            # stay on the old profile and judge it afresh over a new window
+            self.tuner.reset(old)
+            print("Link profile {} not confirmed by both slaves, keeping {}".format(profile, old))
+            return False
+        print("Link profile {}: RF_SETUP 0x{:02X}, {} us x {} retries, {} retries/100 sends".format(
+            profile, speed | power, PROFILES[profile][2], PROFILES[profile][3],
+            self.tuner.last_retries_x100))
+        return ok
+
+    async def survey_and_hop(self):
+        counts = await self.survey()
+        best = rank_channels(counts)[0]
+        if best != self.channel and not await self.hop(best):
+            self._fallback_at = time.ticks_ms()  # survey again later, once both slaves answer
+        return best
+
+    def _answering(self, now):
+        """True while both slaves ACK their frames, so a hop can reach them both."""
+        tx = self.tx
+        for target in ('left', 'right'):
+            if tx.fail_streak[target] or time.ticks_diff(now, tx.last_ok[target]) >= 2 * KEEPALIVE_MS:
+                return False
+        return True
+
+    async def _fall_back(self, timeout_ms=2000):
+        """
+        Go back to the rendezvous settings, taking along any slave that still
+        answers so it keeps getting alerts instead of waiting out its own
+        LINK_TIMEOUT_MS on the old channel.
+        """
+        tx = self.tx
+        answering = [target for target in ('left', 'right') if tx.fail_streak[target] < self.lost_after]
+        speed, power = PROFILES[self.tuner.profile][:2]
+        default_speed, default_power = PROFILES[DEFAULT_PROFILE][:2]
+        if answering and (speed, power) != (default_speed, default_power):
+            # the slave switches once it has ACKed, so follow it before the HOP
+            answering = await self._send_control(answering, FRAME_RADIO, default_speed | default_power, timeout_ms)
+            await self._switch(lambda: set_rf(self.nrf, default_speed | default_power))
+        if answering and self.channel != RENDEZVOUS_CHANNEL:
+            await self._send_control(answering, FRAME_HOP, RENDEZVOUS_CHANNEL, timeout_ms)
+        await self._hold()
+        retune(self.nrf, RENDEZVOUS_CHANNEL)
+        self.channel = RENDEZVOUS_CHANNEL
+        self.tuner.reset()
+        self._apply_profile(self.tuner.profile)
+        for target in self.tx.fail_streak:
+            self.tx.fail_streak[target] = 0
+        self._release()
+        self._fallback_at = time.ticks_ms()
+        print("Link lost, back on rendezvous channel", RENDEZVOUS_CHANNEL)
+
+    def stats(self):
+        tx = self.tx
+        tuner = self.tuner
+        return {
+            'channel': self.channel,
+            'profile': tuner.profile,
+            'sent': tx.sent,
+            'failed': tx.failed,
+            'coalesced': tx.coalesced,
+            'retries': tx.retries,
+            'retries_x100': tuner.last_retries_x100,
+            'step_ups': tuner.step_ups,
+            'step_downs': tuner.step_downs,
+        }
+
+    def report(self):
+        """Print stats() on one line."""
+        self._reported_at = time.ticks_ms()
+        stats = self.stats()
+        print("Link:", ", ".join("{} {}".format(key, stats[key]) for key in sorted(stats)))
+
+    async def run(self, interval_ms=250):
+        await self.survey_and_hop()
+        tx = self.tx
+        while True:
+            await asyncio.sleep_ms(interval_ms)
+            now = time.ticks_ms()
+            for target in ('left', 'right'):
+                if (time.ticks_diff(now, tx.last_ok[target]) >= KEEPALIVE_MS
+                        and time.ticks_diff(now, self._last_ping[target]) >= KEEPALIVE_MS
+                        and not tx.control_pending(target)):
+                    self._last_ping[target] = now
+                    tx.submit_control(target, FRAME_PING)
+            lost = max(tx.fail_streak.values()) >= self.lost_after
+            if lost and (self.channel != RENDEZVOUS_CHANNEL or self.tuner.profile != DEFAULT_PROFILE):
+                await self._fall_back()
+                self.report()
+            elif (self._fallback_at is not None and self._answering(now)
+                    and time.ticks_diff(now, self._fallback_at) >= self.resurvey_ms):
+                self._fallback_at = None
+                await self.survey_and_hop()
+            elif self.tuner.wanted != self.tuner.profile:
+                await self.set_profile(self.tuner.wanted)
+                self.report()
+            elif self.report_ms and time.ticks_diff(now, self._reported_at) >= self.report_ms:
+                self.report()
+
 def main():
     nrf = radio_setup()
     while True:
@@ -67,6 +541,9 @@ def main():
         time.sleep(1)
         transmit(nrf, "right")
         time.sleep(1)
+        # Both sides at once: one no-ACK broadcast instead of two sends
+        transmit(nrf, "both")
+        time.sleep(1)
 
 # Main execution flow
 if __name__ == "__main__":
@@ -0,0 +1,107 @@
+# outbox.py
+# Persistent SMS outbox: every message goes to every contact, failures are
+# retried with exponential backoff, and unsent messages survive a reboot.
+import json
+import os
+from compat import asyncio, ticks_ms, ticks_diff, ticks_add
+
+
+class SmsOutbox:
+    """
+    Queue of (number, message) waiting to be sent by sender(number, message),
+    an async function returning True on success.
+
+    add() fans a message out to a list of contacts; run() sends everything
+    that is due back to back, so one modem session covers all contacts. A
+    failed send is retried after base_ms, doubling up to max_ms, and never
+    given up; a sender that raises counts as a failed attempt. The file at
+    path holds the unsent messages and is rewritten only when that set
+    changes, not on every retry, since flash writes briefly stall the other
+    core.
+    """
+
+    def __init__(self, sender, path="outbox.json", base_ms=5000, max_ms=300000):
+        self.sender = sender
+        self.path = path
+        self.base_ms = base_ms
+        self.max_ms = max_ms
+        self.sent = 0
+        self.failures = 0
+        self._entries = []      # [number, message, attempts, due ticks_ms]
+        self._wake = asyncio.Event()
+        self._load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        now = ticks_ms()
+        for number, message in saved:
+            self._entries.append([number, message, 0, now])
+        if self._entries:
+            print("Outbox: {} unsent message(s) restored".format(len(self._entries)))
+
+    def _save(self):
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump([[e[0], e[1]] for e in self._entries], f)
+            try:
+                os.rename(tmp, self.path)  # replace in one step so a reset never leaves half a file
+            except OSError:
+                os.remove(self.path)  # FAT cannot rename over an existing file
+                os.rename(tmp, self.path)
+        except OSError as e:
+            print("Outbox: could not save:", e)
+
+    def add(self, message, contacts):
+        now = ticks_ms()
+        for number in contacts:
+            self._entries.append([number, message, 0, now])
+        self._save()
+        self._wake.set()
+
+    def _backoff_ms(self, attempts):
+        return min(self.base_ms << min(attempts - 1, 16), self.max_ms)
+
+    async def run(self):
+        while True:
+            now = ticks_ms()
+            changed = False
+            for entry in list(self._entries):
+                if ticks_diff(entry[3], now) > 0:
+                    continue
+                try:
+                    ok = await self.sender(entry[0], entry[1])
+                except Exception as e:
+                    # e.g. a UART error or an unparseable reply; retried like any failure
+                    print("Outbox: SMS to {} raised {!r}".format(entry[0], e))
+                    ok = False
+                if ok:
+                    self._entries.remove(entry)
+                    self.sent += 1
+                    changed = True
+                else:
+                    entry[2] += 1
+                    entry[3] = ticks_add(ticks_ms(), self._backoff_ms(entry[2]))
+                    self.failures += 1
+                    print("Outbox: SMS to {} failed, retry {} in {} s".format(
+                        entry[0], entry[2], self._backoff_ms(entry[2]) // 1000))
+            if changed:
+                self._save()
+            # sleep until the next retry is due, or until add() is called
+            self._wake.clear()
+            wait = self.max_ms
+            now = ticks_ms()
+            for entry in self._entries:
+                wait = min(wait, max(ticks_diff(entry[3], now), 0))
+            if wait:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), wait / 1000)
+                except asyncio.TimeoutError:
+                    pass
@@ -0,0 +1,157 @@
+# protocol.py
+# On-air formats shared by the master (nrfmaster.py, main.py) and the slaves.
+# Encoders write into caller-owned buffers and decoders read fields in place,
+# so both ends can use them without allocating.
+import micropython
+from micropython import const
+
+# ------------------------------
+# Alert frame (master -> slave)
+# ------------------------------
+# byte 0 : ALERT_VERSION << 4 | frame type
+# byte 1 : sequence number, 0-255; a retransmission keeps its number
+# byte 2 : mode << 4 | side mask (SIDE_LEFT, SIDE_RIGHT or SIDE_BOTH)
+# byte 3 : distance in DISTANCE_BUCKET_MM steps, saturates at 255
+# byte 4 : SIDE_BOTH alerts only (BOTH_ALERT_SIZE): the right side's
+#          distance, with byte 3 the left side's
+# The old 4-byte little-endian int triggers have 0 in the version nibble,
+# so they can never be mistaken for a frame.
+ALERT_VERSION = const(1)
+ALERT_SIZE = const(4)
+BOTH_ALERT_SIZE = const(5)
+FRAME_ALERT = const(1)
+SIDE_LEFT = const(1)
+SIDE_RIGHT = const(2)
+SIDE_BOTH = const(3)
+DISTANCE_BUCKET_MM = const(16)
+
+# Alert threshold of each master mode (0: NORMAL, 1: CROWD). The slaves
+# scale alarm strength over it, so it must match what the master alerts at.
+MODE_THRESHOLD_MM = (2000, 800)
+
+# Both slaves also listen here for SIDE_BOTH alerts, sent without ACK. The
+# right slave can only put it on pipe 2-5, which share the top four address
+# bytes with its own pipe 1, so only the first byte differs from RIGHT_PIPE.
+BROADCAST_PIPE = b"\xe2\xf0\xf0\xf0\x02"
+
+
+@micropython.native
+def pack_alert(buf, seq, side, distance_mm, mode):
+    buf[0] = (ALERT_VERSION << 4) | FRAME_ALERT
+    buf[1] = seq & 0xFF
+    buf[2] = ((mode & 0x0F) << 4) | (side & 0x0F)
+    bucket = distance_mm // DISTANCE_BUCKET_MM
+    buf[3] = bucket if bucket < 255 else 255
+    return ALERT_SIZE
+
+
+@micropython.native
+def pack_both_alert(buf, seq, left_mm, right_mm, mode):
+    """SIDE_BOTH alert carrying each side's distance; buf holds BOTH_ALERT_SIZE bytes."""
+    pack_alert(buf, seq, SIDE_BOTH, left_mm, mode)
+    bucket = right_mm // DISTANCE_BUCKET_MM
+    buf[4] = bucket if bucket < 255 else 255
+    return BOTH_ALERT_SIZE
+
+
+@micropython.native
+def frame_type(buf, n):
+    """Return the frame type of buf[:n], or 0 if it is not a current-version frame."""
+    if n < ALERT_SIZE or (buf[0] >> 4) != ALERT_VERSION:
+        return 0
+    return buf[0] & 0x0F
+
+
+# Field readers for a buffer that frame_type() accepted; seq and side are
+# in the same place in every frame type
+@micropython.native
+def alert_seq(buf):
+    return buf[1]
+
+
+@micropython.native
+def alert_side(buf):
+    return buf[2] & 0x0F
+
+
+@micropython.native
+def alert_mode(buf):
+    return buf[2] >> 4
+
+
+@micropython.native
+def alert_distance(buf, n=ALERT_SIZE, side=SIDE_LEFT):
+    """Distance for side; a right slave reads byte 4 of a two-distance SIDE_BOTH alert."""
+    if side == SIDE_RIGHT and n >= BOTH_ALERT_SIZE:
+        return buf[4] * DISTANCE_BUCKET_MM
+    return buf[3] * DISTANCE_BUCKET_MM
+
+
+def mode_threshold(mode):
+    """Alert threshold in mm for a mode number; the NORMAL one if it is unknown."""
+    if mode < len(MODE_THRESHOLD_MM):
+        return MODE_THRESHOLD_MM[mode]
+    return MODE_THRESHOLD_MM[0]
+
+# ------------------------------
+# Link control (master -> slave)
+# ------------------------------
+# Same layout as an alert, with the mode nibble 0 and byte 3 a parameter:
+# FRAME_HOP   : byte 3 = channel to move to once this frame has been ACKed
+# FRAME_PING  : byte 3 unused; keeps the link alive and fetches telemetry
+# FRAME_RADIO : byte 3 = RF_SETUP speed and power bits to switch to once ACKed
+# Control frames are always ACKed, so they share the target's sequence numbers.
+FRAME_HOP = const(2)
+FRAME_PING = const(3)
+FRAME_RADIO = const(4)
+
+# Everyone starts here, and returns here when the link is lost
+RENDEZVOUS_CHANNEL = const(108)
+DEFAULT_RF_SETUP = const(0x06)  # 1 Mbps, 0 dBm
+# The master pings a slave it has not reached for this long; a slave that
+# hears nothing for LINK_TIMEOUT_MS goes back to RENDEZVOUS_CHANNEL
+KEEPALIVE_MS = const(2000)
+LINK_TIMEOUT_MS = const(8000)
+
+
+@micropython.native
+def pack_control(buf, kind, seq, side, arg):
+    buf[0] = (ALERT_VERSION << 4) | kind
+    buf[1] = seq & 0xFF
+    buf[2] = side & 0x0F
+    buf[3] = arg & 0xFF
+    return ALERT_SIZE
+
+
+@micropython.native
+def frame_arg(buf):
+    return buf[3]
+
+# ------------------------------
+# Slave telemetry (ACK payload)
+# ------------------------------
+# byte 0    : TELEMETRY_VERSION
+# bytes 1-2 : battery voltage in mV, little endian; 0 = not measured
+# bytes 3-4 : seconds since the last alarm, little endian; 0xFFFF = never / older
+# byte 5    : error counter (invalid or undecodable packets), saturates at 255
+TELEMETRY_VERSION = 1
+TELEMETRY_SIZE = 6
+NEVER = 0xFFFF
+
+
+def pack_telemetry(buf, battery_mv, last_alarm_s, errors):
+    buf[0] = TELEMETRY_VERSION
+    buf[1] = battery_mv & 0xFF
+    buf[2] = (battery_mv >> 8) & 0xFF
+    last_alarm_s = min(last_alarm_s, NEVER)
+    buf[3] = last_alarm_s & 0xFF
+    buf[4] = last_alarm_s >> 8
+    buf[5] = min(errors, 255)
+    return TELEMETRY_SIZE
+
+
+def unpack_telemetry(buf, n):
+    """Return (battery_mv, last_alarm_s, errors), or None if buf is not telemetry."""
+    if n < TELEMETRY_SIZE or buf[0] != TELEMETRY_VERSION:
+        return None
+    return buf[1] | (buf[2] << 8), buf[3] | (buf[4] << 8), buf[5]
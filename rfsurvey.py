@@ -0,0 +1,81 @@
+# rfsurvey.py
+# 2.4 GHz band survey with the nRF24L01's received power detector (RPD),
+# used to move the alert link to the quietest channel.
+from nrf24l01 import CONFIG, RF_CH, PWR_UP, PRIM_RX
+import time
+
+CHANNELS = 126  # RF_CH 0-125, 2400-2525 MHz
+
+
+def retune(nrf, channel):
+    """Move the radio to channel, pausing reception while RF_CH changes."""
+    ce = nrf.ce()
+    nrf.ce(0)
+    nrf.set_channel(channel)
+    nrf.ce(ce)
+
+
+def set_rf(nrf, rf_setup):
+    """Apply the speed and power bits of an RF_SETUP value, pausing reception."""
+    ce = nrf.ce()
+    nrf.ce(0)
+    nrf.set_power_speed(rf_setup & 0x06, rf_setup & 0x28)
+    nrf.ce(ce)
+
+
+def begin_survey(nrf):
+    """Put the radio in RX for sweeping; returns what end_survey() restores."""
+    saved = (nrf.ce(), nrf.reg_read(CONFIG), nrf.reg_read(RF_CH))
+    nrf.ce(0)
+    nrf.reg_write(CONFIG, saved[1] | PWR_UP | PRIM_RX)
+    time.sleep_ms(2)  # power-up settling
+    return saved
+
+
+def end_survey(nrf, saved):
+    ce, config, channel = saved
+    nrf.set_channel(channel)
+    nrf.reg_write(CONFIG, config)
+    nrf.ce(ce)
+
+
+def sweep(nrf, counts, dwell_us=200):
+    """Listen once on every channel, adding 1 to counts[ch] where RPD fired."""
+    for ch in range(CHANNELS):
+        nrf.set_channel(ch)
+        nrf.ce(1)
+        time.sleep_us(dwell_us)
+        nrf.ce(0)
+        if nrf.rpd() and counts[ch] < 255:
+            counts[ch] += 1
+
+
+def survey(nrf, sweeps=16, dwell_us=200):
+    """Blocking survey; returns a bytearray of per-channel hit counts."""
+    counts = bytearray(CHANNELS)
+    saved = begin_survey(nrf)
+    try:
+        for _ in range(sweeps):
+            sweep(nrf, counts, dwell_us)
+    finally:
+        end_survey(nrf, saved)
+    return counts
+
+
+def rank_channels(counts):
+    """
+    Channels ordered quietest first. A channel's own hits count double and
+    its neighbours' once, since a 1 Mbps signal spreads over about 1 MHz
+    either side. Ties go to the higher channel, further from Wi-Fi.
+    """
+    last = len(counts) - 1
+    scores = []
+    for ch in range(len(counts)):
+        score = 2 * counts[ch]
+        if ch > 0:
+            score += counts[ch - 1]
+        if ch < last:
+            score += counts[ch + 1]
+        scores.append((score, -ch))
+    scores.sort()
+    return [-ch for _, ch in scores]
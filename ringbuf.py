@@ -0,0 +1,50 @@
+# ringbuf.py
+# Lock-free single-producer/single-consumer sample ring for passing data
+# between the RP2040's two cores without allocating.
+from array import array
+
+
+class SampleRing:
+    """
+    Fixed-size ring of (channel, value) samples; value is 0-65535, channel 0-255.
+
+    Only the producer writes head and dropped; only the consumer writes tail.
+    Indices run modulo twice the size so full and empty can be told apart
+    while staying small ints. A full ring drops the new sample and counts it.
+    """
+
+    def __init__(self, size=64):
+        if size & (size - 1):
+            raise ValueError('size must be a power of two')
+        self._values = array('H', bytes(2 * size))
+        self._channels = bytearray(size)
+        self._mask = size - 1
+        self._wrap = 2 * size - 1
+        self._head = 0
+        self._tail = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return (self._head - self._tail) & self._wrap
+
+    def push(self, channel, value):
+        """Producer side. Returns False (and counts a drop) if the ring is full."""
+        head = self._head
+        if ((head - self._tail) & self._wrap) > self._mask:
+            self.dropped += 1
+            return False
+        i = head & self._mask
+        self._values[i] = value
+        self._channels[i] = channel
+        self._head = (head + 1) & self._wrap  # publish after the data is written
+        return True
+
+    def pop(self):
+        """Consumer side. Returns (channel << 16) | value, or -1 if empty."""
+        tail = self._tail
+        if tail == self._head:
+            return -1
+        i = tail & self._mask
+        sample = (self._channels[i] << 16) | self._values[i]
+        self._tail = (tail + 1) & self._wrap
+        return sample
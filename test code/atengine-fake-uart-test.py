@@ -0,0 +1,164 @@
+# Runs the AT engine and the GSM helpers built on it against a fake UART,
+# so they can be checked on a PC (python3 "test code/atengine-fake-uart-test.py")
+# or on the board without a modem attached.
+import sys
+try:
+    import os
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+except (ImportError, NameError, AttributeError):
+    pass  # on the board every module sits in the root folder
+try:
+    import asyncio
+except ImportError:
+    import uasyncio as asyncio
+from atengine import ATEngine, RESULT_OK, RESULT_ERROR, RESULT_TIMEOUT
+from modem import ModemSupervisor, STATUS_READY, STATUS_NOT_REGISTERED
+from gnss import GnssTracker
+from outbox import SmsOutbox
+
+failures = 0
+
+def check(name, ok):
+    global failures
+    print("PASS" if ok else "FAIL", name)
+    if not ok:
+        failures += 1
+
+class FakeUART:
+    """Answers each command line with replies[cmd]; a reply of None means silence."""
+
+    def __init__(self, replies):
+        self.replies = replies
+        self.rx = b""
+        self.written = []
+
+    def any(self):
+        return len(self.rx)
+
+    def read(self, n):
+        data = self.rx[:n]
+        self.rx = self.rx[n:]
+        return data
+
+    def write(self, buf):
+        self.written.append(bytes(buf))
+        if buf.endswith(b"\r\n"):
+            reply = self.replies.get(buf[:-2])
+        elif buf.endswith(b"\x1a"):
+            reply = self.replies.get(b"<payload>")
+        else:
+            reply = None
+        if callable(reply):
+            reply = reply()
+        if reply:
+            self.rx += reply
+
+async def engine_tests():
+    uart = FakeUART({
+        b"AT": b"\r\nOK\r\n",
+        b'AT+CMGS="+100"': b"\r\n> ",
+        b"<payload>": b"\r\n+CMGS: 17\r\n\r\nOK\r\n",
+        b"AT+CSQ": b"\r\n+CMTI: \"SM\",3\r\n+CSQ: 20,99\r\n\r\nOK\r\n",
+        b"AT+QGPSLOC=2": b"\r\n+CME ERROR: 516\r\n",
+        b"AT+SLOW": None,
+        b'AT+CMGS="+300"': None,
+    })
+    at = ATEngine(uart)
+    urcs = []
+    at.on(b"+CMTI:", urcs.append)
+
+    result, lines = await at.command("AT")
+    check("plain OK", result == RESULT_OK and lines == [])
+
+    result, lines = await at.command('AT+CMGS="+100"', 1000, b"hello\x1a")
+    check("payload written at the '>' prompt", uart.written[-1] == b"hello\x1a")
+    check("prompt command result", result == RESULT_OK and lines == [b"+CMGS: 17"])
+
+    result, lines = await at.command("AT+CSQ")
+    check("URC mid-command goes to its handler", urcs == [b'+CMTI: "SM",3'])
+    check("URC kept out of the response", result == RESULT_OK and lines == [b"+CSQ: 20,99"])
+
+    result, lines = await at.command("AT+QGPSLOC=2")
+    check("+CME ERROR is a final result", result == RESULT_ERROR and lines == [b"+CME ERROR: 516"])
+
+    result, lines = await at.command("AT+SLOW", 50)
+    check("timeout", result == RESULT_TIMEOUT and at.timeouts == 1)
+
+    result, lines = await at.command('AT+CMGS="+300"', 50, b"late\x1a")
+    check("no prompt: payload held back, ESC sent",
+          result == RESULT_TIMEOUT and uart.written[-1] == b"\x1b" and b"late\x1a" not in uart.written)
+
+    uart.rx += b"\r\n+CMTI: \"SM\",4\r\n"
+    at.poll()
+    check("URC between commands", urcs[-1] == b'+CMTI: "SM",4')
+
+async def modem_tests():
+    registration = [b"\r\n+CREG: 1,1\r\n\r\nOK\r\n"]
+    uart = FakeUART({
+        b"ATE0": b"\r\nOK\r\n",
+        b"AT+CMGF=1": b"\r\nOK\r\n",
+        b"AT+CREG=1": b"\r\nOK\r\n",
+        b"AT+CREG?": lambda: registration[0],
+        b"AT+CSQ": b"\r\n+CSQ: 18,99\r\n\r\nOK\r\n",
+    })
+    at = ATEngine(uart)
+    changes = []
+    modem = ModemSupervisor(at, on_change=changes.append)
+    check("supervisor ready", await modem.check() and modem.rssi == 18)
+    uart.rx += b"\r\n+CREG: 0\r\n"
+    at.poll()
+    check("+CREG URC updates the cached status",
+          modem.status == STATUS_NOT_REGISTERED and changes == [STATUS_READY, STATUS_NOT_REGISTERED])
+
+async def gnss_tests():
+    fix = [b"\r\n+CME ERROR: 516\r\n"]
+    uart = FakeUART({
+        b"AT+QGPS=1": b"\r\n+CME ERROR: 504\r\n",
+        b"AT+QGPSLOC=2": lambda: fix[0],
+    })
+    gnss = GnssTracker(ATEngine(uart))
+    check("no fix yet", not await gnss.update() and gnss.enabled
+          and gnss.describe() == "Location: unknown")
+    fix[0] = b"\r\n+QGPSLOC: 061951.000,12.97160,77.59456,1.0,920.0,3,0.00,0.0,0.0,110320,09\r\n\r\nOK\r\n"
+    check("fix cached", await gnss.update() and (gnss.lat, gnss.lon) == ("12.97160", "77.59456"))
+
+async def outbox_tests(path):
+    results = [False, OSError("UART"), True, True]
+    sent = []
+
+    async def sender(number, message):
+        sent.append(number)
+        result = results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    outbox = SmsOutbox(sender, path=path, base_ms=20)
+    outbox.add("SOS", ["+100", "+200"])
+    task = asyncio.create_task(outbox.run())
+    for _ in range(50):
+        if not len(outbox):
+            break
+        await asyncio.sleep(0.01)
+    check("failed and raising sends retried after backoff",
+          sent == ["+100", "+200", "+100", "+200"] and outbox.failures == 2 and not task.done())
+    task.cancel()
+    check("delivered messages leave the file", len(SmsOutbox(sender, path=path)) == 0)
+
+async def main():
+    await engine_tests()
+    await modem_tests()
+    await gnss_tests()
+    path = "outbox-test.json"
+    try:
+        await outbox_tests(path)
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    print("{} check(s) failed".format(failures) if failures else "All checks passed")
+
+asyncio.run(main())
+if failures:
+    sys.exit(1)
@@ -0,0 +1,120 @@
+# tof_array.py
+# Brings up several VL53L1X sensors on one shared I2C bus and ranges them in
+# staggered slots so neighbouring sensors never fire at the same time.
+from array import array
+from PiicoDev_Unified import create_unified_i2c, sleep_ms
+from PiicoDev_VL53L1X import PiicoDev_VL53L1X, STATUS_UNKNOWN
+from compat import ticks_ms, ticks_diff
+
+INVALID_DISTANCE = 0xFFFF  # stored in read_all() results when a sensor failed or timed out
+DEFAULT_ADDRESS = 0x29
+
+
+class ToFArray:
+    """
+    N VL53L1X sensors sharing one bus, each with its XSHUT pin on a GPIO.
+
+    Sensors are powered up one at a time through their XSHUT pins and moved
+    from the default address to first_addr, first_addr + 1, ...  Sensor i
+    ranges in slot i % slots; only one slot is active at a time, so with
+    sensors ordered by position adjacent sensors never range together.
+    Sensors should keep the default new-sample interrupt configuration.
+    """
+
+    def __init__(self, xshut_pins, bus=None, freq=None, sda=None, scl=None,
+                 first_addr=0x30, slots=2, slot_timeout=200):
+        self.i2c = create_unified_i2c(bus=bus, freq=freq, sda=sda, scl=scl)
+        # hold every sensor in shutdown so none answers on the default address
+        for pin in xshut_pins:
+            pin.value(0)
+        sleep_ms(10)
+        self.sensors = []
+        for i, pin in enumerate(xshut_pins):
+            pin.value(1)
+            sleep_ms(2)  # firmware boot time
+            sensor = PiicoDev_VL53L1X(address=DEFAULT_ADDRESS, i2c=self.i2c)
+            sensor.stop_ranging()  # the default configuration auto-starts ranging
+            sensor.change_addr(first_addr + i)
+            self.sensors.append(sensor)
+
+        n = len(self.sensors)
+        slots = max(1, min(slots, n))
+        self.slot_timeout = slot_timeout
+        self._slot_members = tuple(tuple(range(s, n, slots)) for s in range(slots))
+        self._slot_masks = tuple(sum(1 << i for i in members) for members in self._slot_members)
+        self._running = False
+        self._slot = 0
+        self._pending = 0
+        self._slot_start = 0
+        # compact results, indexed like self.sensors
+        self.distances = array('H', [INVALID_DISTANCE] * n)
+        self.statuses = array('B', [STATUS_UNKNOWN] * n)
+
+    def _start_slot(self, slot):
+        self._slot = slot
+        self._pending = self._slot_masks[slot]
+        for i in self._slot_members[slot]:
+            sensor = self.sensors[i]
+            try:
+                sensor.clear_interrupt()
+                sensor.start_ranging()
+            except OSError:
+                self._finish(i, INVALID_DISTANCE)
+        self._slot_start = ticks_ms()
+
+    def _finish(self, i, distance):
+        sensor = self.sensors[i]
+        try:
+            sensor.stop_ranging()
+        except OSError:
+            distance = INVALID_DISTANCE
+        self.distances[i] = distance
+        self.statuses[i] = STATUS_UNKNOWN if sensor.status_code is None else sensor.status_code
+        self._pending &= ~(1 << i)
+
+    def start(self):
+        """Begin a new sweep at the first slot."""
+        self._running = True
+        self._start_slot(0)
+
+    def poll(self):
+        """
+        Advance the schedule without blocking.
+        Returns True when the last slot has completed, i.e. distances holds a full sweep.
+        """
+        for i in self._slot_members[self._slot]:
+            if not self._pending & (1 << i):
+                continue
+            distance = self.sensors[i].read_if_ready()
+            if distance is None:
+                continue
+            if distance != distance:  # NaN: the sensor did not answer
+                distance = INVALID_DISTANCE
+            self._finish(i, distance)
+
+        if self._pending and ticks_diff(ticks_ms(), self._slot_start) > self.slot_timeout:
+            for i in self._slot_members[self._slot]:
+                if self._pending & (1 << i):
+                    self._finish(i, INVALID_DISTANCE)
+
+        if self._pending:
+            return False
+        next_slot = self._slot + 1
+        if next_slot == len(self._slot_members):
+            self._start_slot(0)
+            return True
+        self._start_slot(next_slot)
+        return False
+
+    def read_all(self):
+        """Range every sensor once, slot by slot, and return the distances array (mm)."""
+        if not self._running:
+            self.start()
+        while not self.poll():
+            sleep_ms(1)
+        return self.distances
+
+    def stop(self):
+        self._running = False
+        for sensor in self.sensors:
+            sensor.stop_ranging()
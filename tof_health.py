@@ -0,0 +1,133 @@
+# tof_health.py
+# Watches one VL53L1X and re-initialises it in small non-blocking steps when it
+# stops answering, so recovery never stalls the other sensors.
+from PiicoDev_VL53L1X import STATUS_HARDWARE_FAIL
+from compat import ticks_ms, ticks_diff
+
+# recovery states
+HEALTHY = 0
+WARM = 1          # try warm_init()
+RESET = 2         # hold the sensor in soft reset
+BOOT = 3          # poll FIRMWARE__SYSTEM_STATUS
+CONFIGURE = 4     # upload configuration and restore settings
+BACKOFF = 5       # wait before retrying after a failed attempt
+
+BOOT_TIMEOUT = 100   # ms to wait for the firmware to boot
+RETRY_DELAY = 500    # ms between failed recovery attempts
+WARM_GRACE = 5000    # ms after a warm recovery in which failing again forces a reset
+
+
+class SensorHealth:
+    """
+    Wraps a PiicoDev_VL53L1X. Use read_if_ready() in place of the sensor's
+    and call poll() regularly; a sensor that produces max_failures
+    consecutive failed reads or probes (no answer, or HardwareFail status) is
+    re-initialised one step per call. While recovering read_if_ready()
+    returns None. A sensor that stopped answering is first tried with
+    warm_init(); one that reported HardwareFail, or fails again within
+    WARM_GRACE of a warm recovery, goes straight to a soft reset, since it
+    still answers I2C and warm_init() would accept it as it is.
+    """
+
+    def __init__(self, sensor, max_failures=3, probe_interval=500):
+        self.sensor = sensor
+        self.max_failures = max_failures
+        self.probe_interval = probe_interval
+        self.failures = 0
+        self.recoveries = 0
+        self.state = HEALTHY
+        self._last_ok = ticks_ms()
+        self._state_start = 0
+        self._cold = False      # skip warm_init() on the next recovery
+        self._warm_at = None    # ticks_ms of the last warm recovery
+
+    @property
+    def healthy(self):
+        return self.state == HEALTHY
+
+    def _enter(self, state):
+        self.state = state
+        self._state_start = ticks_ms()
+
+    def _fail(self, hardware=False):
+        self.failures += 1
+        if hardware:
+            self._cold = True
+        if self.failures >= self.max_failures:
+            if self._warm_at is not None and ticks_diff(ticks_ms(), self._warm_at) < WARM_GRACE:
+                self._cold = True  # the warm restart did not fix it
+            print("ToF sensor 0x{:02X} not responding, re-initialising".format(self.sensor.addr))
+            self._enter(WARM)
+
+    def _ok(self):
+        self.failures = 0
+        self._cold = False
+        self._last_ok = ticks_ms()
+
+    def read_if_ready(self):
+        if self.state != HEALTHY:
+            self.poll()
+            return None
+        distance = self.sensor.read_if_ready()
+        if distance is None:
+            return None
+        if distance != distance:  # NaN: no answer
+            self._fail()
+            return None
+        if self.sensor.status_code == STATUS_HARDWARE_FAIL:
+            self._fail(hardware=True)
+            return None
+        self._ok()
+        return distance
+
+    def poll(self):
+        """Run one health or recovery step. Returns True when the sensor has just been recovered."""
+        sensor = self.sensor
+        now = ticks_ms()
+        elapsed = ticks_diff(now, self._state_start)
+        try:
+            if self.state == HEALTHY:
+                # a quiet sensor (e.g. threshold interrupts with no obstacle) is probed periodically
+                if ticks_diff(now, self._last_ok) >= self.probe_interval:
+                    sensor.data_ready()
+                    self._ok()
+                return False
+            if self.state == WARM:
+                if not self._cold and sensor.warm_init():
+                    return self._recovered(warm=True)
+                self._enter(RESET)
+                sensor.writeReg(0x0000, 0x00) # SOFT_RESET
+            elif self.state == RESET:
+                if elapsed >= 1:
+                    sensor.writeReg(0x0000, 0x01)
+                    self._enter(BOOT)
+            elif self.state == BOOT:
+                if sensor.booted():
+                    self._enter(CONFIGURE)
+                elif elapsed > BOOT_TIMEOUT:
+                    self._enter(BACKOFF)
+            elif self.state == CONFIGURE:
+                if sensor.read_model_id() != 0xEACC:
+                    self._enter(BACKOFF)
+                    return False
+                sensor.upload_config()
+                sensor.restore_settings()
+                return self._recovered()
+            elif self.state == BACKOFF:
+                if elapsed >= RETRY_DELAY:
+                    self._enter(WARM)
+        except OSError:
+            if self.state == HEALTHY:
+                self._fail()
+            else:
+                self._enter(BACKOFF)
+        return False
+
+    def _recovered(self, warm=False):
+        print("ToF sensor 0x{:02X} recovered{}".format(self.sensor.addr, " (warm)" if warm else ""))
+        self.recoveries += 1
+        self._cold = False
+        self._warm_at = ticks_ms() if warm else None
+        self._ok()
+        self._enter(HEALTHY)
+        return True
@@ -0,0 +1,128 @@
+# tof_sweep.py
+# Steps a single VL53L1X's ROI across a grid of zones to build a coarse depth map.
+from array import array
+from PiicoDev_Unified import sleep_ms
+from PiicoDev_VL53L1X import roi_center_spad
+from compat import ticks_ms, ticks_diff
+
+INVALID_DISTANCE = 0xFFFF  # stored in the depth map when a zone failed or timed out
+
+# direction() results
+DIRECTION_NONE = 0
+DIRECTION_HIGH = 1
+DIRECTION_CENTRE = 2
+DIRECTION_LOW = 3
+
+
+class ROISweep:
+    """
+    Ranges one zone at a time and stores results in depth, a row-major
+    cols x rows array of distances in mm. Row 0 is the top of ST's SPAD map;
+    the receive lens inverts the image, so which way it faces depends on how
+    the sensor is mounted. Pass invert=True if row 0 looks down.
+
+    rate caps the number of complete frames per second (None: as fast as the
+    timing budget allows). Each zone takes one timing budget, so a 4x4 sweep
+    at 20 ms per zone tops out around 3 frames per second.
+
+    The sweep waits for a new sample in every zone, so it clears any
+    distance threshold: with one armed, zones outside the window would
+    never report and would all time out as INVALID_DISTANCE.
+    """
+
+    def __init__(self, sensor, cols=4, rows=4, rate=None, zone_timeout=200, invert=False):
+        if cols < 1 or rows < 1 or 16 // cols < 4 or 16 // rows < 4:
+            raise ValueError('zones must be at least 4x4 SPADs: use at most a 4x4 grid')
+        self.sensor = sensor
+        self.cols = cols
+        self.rows = rows
+        self.zone_timeout = zone_timeout
+        self.invert = invert
+        self.frame_period = 1000 // rate if rate else 0
+        width = 16 // cols
+        height = 16 // rows
+        centers = bytearray(cols * rows)
+        for row in range(rows):
+            for col in range(cols):
+                centers[row * cols + col] = roi_center_spad(col * width + width // 2, row * height + (height - 1) // 2)
+        self._centers = bytes(centers)
+        self.depth = array('H', [INVALID_DISTANCE] * (cols * rows))
+        self._zone = 0
+        self._zone_start = 0
+        self._frame_start = 0
+        self._ranging = False
+        sensor.stop_ranging()
+        sensor.clear_distance_threshold()
+        sensor.set_roi(width, height)
+
+    def _start_zone(self, zone):
+        self._zone = zone
+        sensor = self.sensor
+        sensor.set_roi_center(self._centers[zone])
+        sensor.clear_interrupt()
+        sensor.start_ranging()
+        self._ranging = True
+        self._zone_start = ticks_ms()
+
+    def poll(self):
+        """Advance the sweep without blocking. Returns True when depth holds a complete new frame."""
+        now = ticks_ms()
+        if not self._ranging:
+            if self._zone == 0 and ticks_diff(now, self._frame_start) < self.frame_period:
+                return False  # rate limit between frames
+            if self._zone == 0:
+                self._frame_start = now
+            self._start_zone(self._zone)
+            return False
+
+        distance = self.sensor.read_if_ready()
+        if distance is None:
+            if ticks_diff(now, self._zone_start) <= self.zone_timeout:
+                return False
+            distance = INVALID_DISTANCE
+        elif distance != distance:  # NaN: the sensor did not answer
+            distance = INVALID_DISTANCE
+        self.sensor.stop_ranging()
+        self._ranging = False
+        self.depth[self._zone] = distance
+        zone = self._zone + 1
+        if zone == len(self.depth):
+            self._zone = 0
+            return True
+        self._start_zone(zone)
+        return False
+
+    def read_frame(self):
+        """Block until a complete frame is available and return the depth array."""
+        while not self.poll():
+            sleep_ms(1)
+        return self.depth
+
+    def direction(self, threshold):
+        """
+        Band of the nearest zone closer than threshold mm: DIRECTION_HIGH (top
+        row), DIRECTION_LOW (bottom row), DIRECTION_CENTRE, or DIRECTION_NONE.
+        Zones that failed hold INVALID_DISTANCE and are never nearer.
+        """
+        nearest = threshold + 1
+        nearest_zone = -1
+        for zone in range(len(self.depth)):
+            distance = self.depth[zone]
+            if distance < nearest:
+                nearest = distance
+                nearest_zone = zone
+        if nearest_zone < 0:
+            return DIRECTION_NONE
+        row = nearest_zone // self.cols
+        if self.invert:
+            row = self.rows - 1 - row
+        if row == 0 and self.rows > 1:
+            return DIRECTION_HIGH
+        if row == self.rows - 1 and self.rows > 1:
+            return DIRECTION_LOW
+        return DIRECTION_CENTRE
+
+    def stop(self):
+        self.sensor.stop_ranging()
+        self._ranging = False
+        self._zone = 0